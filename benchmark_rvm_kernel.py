@@ -0,0 +1,83 @@
+#!/usr/bin/env python3
+"""Script to measure the share of the linear kernels in the training of the bootstrap classifiers.
+
+A cache of the Gram matrix of the cohort can only save the time spent computing the kernels of each iteration (the
+train kernel in EMRVC.fit and the kernels of the predictions of classifier_train.py), so this time bounds its speedup.
+"""
+import argparse
+import time
+from pathlib import Path
+
+from sklearn.metrics.pairwise import linear_kernel
+from sklearn.preprocessing import RobustScaler
+from sklearn_rvm.em_rvm import EMRVC
+
+from classifier_train import load_bootstrap_indices, load_cohort
+
+PROJECT_ROOT = Path.cwd()
+
+
+def main(dataset_name, disease_label, n_bootstrap):
+    """Time the kernels and the fit of the first `n_bootstrap` iterations of a contrast."""
+    # ----------------------------------------------------------------------------
+    participants_path = PROJECT_ROOT / 'data' / dataset_name / 'participants.tsv'
+    freesurfer_path = PROJECT_ROOT / 'data' / dataset_name / 'freesurferData.csv'
+    ids_path = PROJECT_ROOT / 'outputs' / (dataset_name + '_homogeneous_ids.csv')
+
+    hc_label = 1
+
+    classifier_dataset_analysis_dir = (PROJECT_ROOT / 'outputs' / 'classifier_analysis' / dataset_name /
+                                       '{:02d}_vs_{:02d}'.format(hc_label, disease_label))
+
+    # ----------------------------------------------------------------------------
+    image_ids, x_cohort, diagnosis = load_cohort(participants_path, freesurfer_path, ids_path, hc_label, disease_label)
+    resamples = load_bootstrap_indices(classifier_dataset_analysis_dir / 'ids', image_ids, n_bootstrap)
+
+    kernel_time = 0.0
+    training_time = 0.0
+    for _, train_index, test_index in resamples:
+        scaler = RobustScaler()
+        x_data = scaler.fit_transform(x_cohort[train_index])
+        x_test = scaler.transform(x_cohort[test_index])
+        y_data = (diagnosis[train_index] == disease_label).astype('float64')
+
+        # Same calls as train_bootstrap_classifier
+        start = time.time()
+        rvm = EMRVC(kernel='linear')
+        rvm.fit(x_data, y_data)
+        for x in [x_data, x_test]:
+            rvm.predict(x)
+            rvm.predict_proba(x)
+        training_time += time.time() - start
+
+        # Kernels of the fit and of the predict and predict_proba calls on the train and test data
+        start = time.time()
+        linear_kernel(x_data)
+        for _ in range(2):
+            linear_kernel(x_data, rvm.relevance_vectors_)
+            linear_kernel(x_test, rvm.relevance_vectors_)
+        kernel_time += time.time() - start
+
+    print('SUBJECTS: {:d} FEATURES: {:d}'.format(*x_cohort.shape))
+    print('TRAINING TIME: {:.3f}s KERNEL TIME: {:.3f}s ({:.2f}%)'.format(training_time, kernel_time,
+                                                                         100 * kernel_time / training_time))
+    print('MAXIMUM SPEEDUP OF A GRAM MATRIX CACHE: {:.3f}x'.format(training_time / (training_time - kernel_time)))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-D', '--dataset_name',
+                        dest='dataset_name',
+                        help='Dataset name of the classifiers.',
+                        default='ADNI')
+    parser.add_argument('-L', '--disease_label',
+                        dest='disease_label',
+                        help='Disease label of the classifiers.',
+                        type=int, default=17)
+    parser.add_argument('-N', '--n_bootstrap',
+                        dest='n_bootstrap',
+                        help='Number of bootstrap iterations measured.',
+                        type=int, default=20)
+    args = parser.parse_args()
+
+    main(args.dataset_name, args.disease_label, args.n_bootstrap)
@@ -0,0 +1,153 @@
+#!/usr/bin/env python3
+"""Script to compare the speed of the three-tape and the fused training steps of the adversarial autoencoder.
+
+It also measures the training step and the training epoch of the ensembles with stacked weights (see ensemble.py),
+per replica.
+"""
+import argparse
+import time
+
+import numpy as np
+import tensorflow as tf
+
+from ensemble import EnsembleAAE
+from trainer import AAETrainer
+
+
+def benchmark_train_step(trainer, batch_x, batch_y, batch_w, n_steps):
+    """Measure the time (in seconds) of the first execution of the graph and the mean time of the next steps."""
+    start = time.time()
+    trainer.train_step(batch_x, batch_y, batch_w)[0].numpy()
+    first_step_time = time.time() - start
+
+    start = time.time()
+    for _ in range(n_steps):
+        losses = trainer.train_step(batch_x, batch_y, batch_w)
+    # Wait for the last step to finish
+    losses[0].numpy()
+
+    return first_step_time, (time.time() - start) / n_steps
+
+
+def benchmark_train_epoch(train_epoch, n_epochs):
+    """Measure the mean time (in seconds) of the epochs of a traced training epoch, after a first untimed epoch."""
+    train_epoch()
+
+    start = time.time()
+    for _ in range(n_epochs):
+        train_epoch()
+
+    return (time.time() - start) / n_epochs
+
+
+def main(batch_size, n_steps, ensemble_sizes, n_samples, n_epochs):
+    """Benchmark the training steps with data of the same shape as the UK Biobank data."""
+    # ----------------------------------------------------------------------------
+    n_features = 101
+    # 27 ages (from 47 to 73 years old) and 2 genders
+    n_labels = 29
+    h_dim = [100, 100]
+    z_dim = 20
+
+    random_seed = 42
+    np.random.seed(random_seed)
+
+    batch_x = tf.constant(np.random.normal(size=(batch_size, n_features)).astype('float32'))
+    batch_y = tf.constant(np.eye(n_labels)[np.random.randint(0, n_labels, batch_size)].astype('float32'))
+    batch_w = tf.ones([batch_size])
+
+    # ----------------------------------------------------------------------------
+    step_times = {}
+    final_losses = {}
+    initial_weights = None
+    for fused in [False, True]:
+        trainer = AAETrainer(n_features, n_labels, h_dim, z_dim, fused=fused)
+        trainer.reset(random_seed)
+
+        # Start both trainers from the same weights to compare their losses
+        models = [trainer.encoder, trainer.decoder, trainer.discriminator]
+        if initial_weights is None:
+            initial_weights = [model.get_weights() for model in models]
+        else:
+            for model, weights in zip(models, initial_weights):
+                model.set_weights(weights)
+
+        first_step_time, step_times[fused] = benchmark_train_step(trainer, batch_x, batch_y, batch_w, n_steps)
+        final_losses[fused] = np.array([loss.numpy() for loss in trainer.train_step(batch_x, batch_y, batch_w)])
+
+        print('{:>10}: FIRST STEP TIME (TRACING AND COMPILING): {:.2f} s STEP TIME: {:.3f} ms' \
+              .format('fused' if fused else 'three-tape',
+                      first_step_time,
+                      step_times[fused] * 1000))
+
+    print('SPEEDUP: {:.2f}x'.format(step_times[False] / step_times[True]))
+    print('MAX LOSS DIFFERENCE: {:.2e}'.format(np.max(np.abs(final_losses[False] - final_losses[True]))))
+
+    # ----------------------------------------------------------------------------
+    # Whole epochs run in the graph, over a sample of n_samples rows
+    epoch_x = tf.constant(np.random.normal(size=(n_samples, n_features)).astype('float32'))
+    epoch_y = tf.constant(np.eye(n_labels)[np.random.randint(0, n_labels, n_samples)].astype('float32'))
+    epoch_w = tf.ones([n_samples])
+    epoch_batch_size = tf.constant(batch_size, dtype=tf.int32)
+
+    epoch_time = benchmark_train_epoch(lambda: trainer.train_epoch(epoch_x, epoch_y, epoch_w, epoch_batch_size),
+                                       n_epochs)
+    print('{:>10}: EPOCH TIME: {:.1f} ms'.format('fused', epoch_time * 1000))
+
+    # ----------------------------------------------------------------------------
+    # Ensembles with stacked weights, each member with its own batch of the same shape
+    for ensemble_size in ensemble_sizes:
+        random_states = [np.random.RandomState(random_seed + i_member) for i_member in range(ensemble_size)]
+        ensemble = EnsembleAAE(random_states, n_features, n_labels, h_dim, z_dim, learning_rate=0.001)
+
+        x = tf.stack([batch_x] * ensemble_size)
+        y = tf.stack([batch_y] * ensemble_size)
+        batch_indices = tf.constant(np.stack([np.random.permutation(batch_size) for _ in range(ensemble_size)]))
+
+        first_step_time, step_time = benchmark_train_step(ensemble, x, y, batch_indices, n_steps)
+        replica_step_time = step_time / ensemble_size
+
+        print('{:>10}: FIRST STEP TIME (TRACING AND COMPILING): {:.2f} s STEP TIME: {:.3f} ms '
+              'STEP TIME PER REPLICA: {:.3f} ms SPEEDUP: {:.2f}x' \
+              .format('K={:d}'.format(ensemble_size),
+                      first_step_time,
+                      step_time * 1000,
+                      replica_step_time * 1000,
+                      step_times[False] / replica_step_time))
+
+        epoch_x_members = tf.stack([epoch_x] * ensemble_size)
+        epoch_y_members = tf.stack([epoch_y] * ensemble_size)
+        replica_epoch_time = benchmark_train_epoch(
+            lambda: ensemble.train_epoch(epoch_x_members, epoch_y_members, epoch_batch_size), n_epochs) / ensemble_size
+
+        print('{:>10}: EPOCH TIME PER REPLICA: {:.1f} ms SPEEDUP: {:.2f}x' \
+              .format('K={:d}'.format(ensemble_size),
+                      replica_epoch_time * 1000,
+                      epoch_time / replica_epoch_time))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-B', '--batch_size',
+                        dest='batch_size',
+                        help='Number of samples in each batch.',
+                        type=int, default=256)
+    parser.add_argument('-N', '--n_steps',
+                        dest='n_steps',
+                        help='Number of training steps measured.',
+                        type=int, default=1000)
+    parser.add_argument('-K', '--ensemble_sizes',
+                        dest='ensemble_sizes',
+                        help='Numbers of replicas of the stacked ensembles measured.',
+                        type=int, nargs='+', default=[1, 8, 32, 64])
+    parser.add_argument('-S', '--n_samples',
+                        dest='n_samples',
+                        help='Number of samples of the epochs measured.',
+                        type=int, default=10000)
+    parser.add_argument('-E', '--n_epochs',
+                        dest='n_epochs',
+                        help='Number of training epochs measured.',
+                        type=int, default=5)
+    args = parser.parse_args()
+
+    main(args.batch_size, args.n_steps, args.ensemble_sizes, args.n_samples, args.n_epochs)
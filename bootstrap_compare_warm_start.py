@@ -0,0 +1,137 @@
+#!/usr/bin/env python3
+"""Script to compare the deviations of the warm-start bootstrap replicas with the ones of the cold-start replicas.
+
+Each pair of replicas is trained on the same bootstrapped sample (with the same scaler), so their deviations on a
+clinical dataset should agree if the warm start is a safe replacement of the cold start.
+"""
+import argparse
+from pathlib import Path
+
+import joblib
+import numpy as np
+import pandas as pd
+import tensorflow as tf
+from tensorflow import keras
+from tqdm import tqdm
+
+from bootstrap_group_analysis_1x1 import compute_classification_performance
+from utils import COLUMNS_NAME, load_dataset
+
+PROJECT_ROOT = Path.cwd()
+
+
+def compute_deviations(bootstrap_model_dir, clinical_df):
+    """Compute the regional deviations and the reconstruction error of the subjects with a bootstrap replica."""
+    x_dataset = clinical_df[COLUMNS_NAME].values
+
+    tiv = clinical_df['EstimatedTotalIntraCranialVol'].values
+    tiv = tiv[:, np.newaxis]
+
+    x_dataset = (np.true_divide(x_dataset, tiv)).astype('float32')
+
+    encoder = keras.models.load_model(bootstrap_model_dir / 'encoder.h5', compile=False)
+    decoder = keras.models.load_model(bootstrap_model_dir / 'decoder.h5', compile=False)
+
+    scaler = joblib.load(bootstrap_model_dir / 'scaler.joblib')
+
+    enc_age = joblib.load(bootstrap_model_dir / 'age_encoder.joblib')
+    enc_gender = joblib.load(bootstrap_model_dir / 'gender_encoder.joblib')
+
+    x_normalized = scaler.transform(x_dataset)
+
+    age = clinical_df['Age'].values[:, np.newaxis].astype('float32')
+    one_hot_age = enc_age.transform(age)
+
+    gender = clinical_df['Gender'].values[:, np.newaxis].astype('float32')
+    one_hot_gender = enc_gender.transform(gender)
+
+    y_data = np.concatenate((one_hot_age, one_hot_gender), axis=1).astype('float32')
+
+    encoded = encoder(x_normalized, training=False)
+    reconstruction = decoder(tf.concat([encoded, y_data], axis=1), training=False).numpy()
+
+    deviations = np.abs(x_normalized - reconstruction)
+    reconstruction_error = np.mean((x_normalized - reconstruction) ** 2, axis=1)
+
+    return deviations, reconstruction_error
+
+
+def main(dataset_name, disease_label, n_bootstrap, cold_model_name, warm_model_name):
+    """Compare the deviation scores and the AUCs of the first `n_bootstrap` pairs of replicas."""
+    # ----------------------------------------------------------------------------
+    participants_path = PROJECT_ROOT / 'data' / dataset_name / 'participants.tsv'
+    freesurfer_path = PROJECT_ROOT / 'data' / dataset_name / 'freesurferData.csv'
+
+    hc_label = 1
+
+    # ----------------------------------------------------------------------------
+    bootstrap_dir = PROJECT_ROOT / 'outputs' / 'bootstrap_analysis'
+    cold_model_dir = bootstrap_dir / cold_model_name
+    warm_model_dir = bootstrap_dir / warm_model_name
+    ids_path = PROJECT_ROOT / 'outputs' / (dataset_name + '_homogeneous_ids.csv')
+
+    # ----------------------------------------------------------------------------
+    clinical_df = load_dataset(participants_path, ids_path, freesurfer_path)
+    clinical_df = clinical_df.set_index('participant_id')
+
+    comparison_list = []
+
+    for i_bootstrap in tqdm(range(n_bootstrap)):
+        cold_deviations, cold_error = compute_deviations(cold_model_dir / '{:03d}'.format(i_bootstrap), clinical_df)
+        warm_deviations, warm_error = compute_deviations(warm_model_dir / '{:03d}'.format(i_bootstrap), clinical_df)
+
+        auc_cold, _ = compute_classification_performance(pd.DataFrame({'Reconstruction error': cold_error},
+                                                                      index=clinical_df.index),
+                                                         clinical_df, disease_label, hc_label)
+        auc_warm, _ = compute_classification_performance(pd.DataFrame({'Reconstruction error': warm_error},
+                                                                      index=clinical_df.index),
+                                                         clinical_df, disease_label, hc_label)
+
+        comparison_list.append({'i_bootstrap': i_bootstrap,
+                                'deviation_correlation': np.corrcoef(cold_deviations.ravel(),
+                                                                     warm_deviations.ravel())[0, 1],
+                                'error_correlation': np.corrcoef(cold_error, warm_error)[0, 1],
+                                'auc_cold': auc_cold,
+                                'auc_warm': auc_warm})
+
+    comparison_df = pd.DataFrame(comparison_list)
+    comparison_df['auc_difference'] = comparison_df['auc_warm'] - comparison_df['auc_cold']
+
+    comparison_dir = bootstrap_dir / dataset_name / ('{:02d}_vs_{:02d}'.format(hc_label, disease_label))
+    comparison_dir.mkdir(parents=True, exist_ok=True)
+    comparison_df.to_csv(comparison_dir / 'warm_start_comparison.csv', index=False)
+
+    # ----------------------------------------------------------------------------
+    for column in ['deviation_correlation', 'error_correlation', 'auc_cold', 'auc_warm', 'auc_difference']:
+        print('{:>22}: {:.3f} ; 95% CI [{:.3f}, {:.3f}]'.format(column.upper(),
+                                                               comparison_df[column].mean(),
+                                                               np.percentile(comparison_df[column], 2.5),
+                                                               np.percentile(comparison_df[column], 97.5)))
+
+    print('MEAN ABSOLUTE AUC DIFFERENCE: {:.3f}'.format(np.mean(np.abs(comparison_df['auc_difference']))))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-D', '--dataset_name',
+                        dest='dataset_name',
+                        help='Dataset name to compare the deviations.')
+    parser.add_argument('-L', '--disease_label',
+                        dest='disease_label',
+                        help='Disease label used to compute the AUCs.',
+                        type=int)
+    parser.add_argument('-N', '--n_bootstrap',
+                        dest='n_bootstrap',
+                        help='Number of pairs of replicas compared.',
+                        type=int, default=100)
+    parser.add_argument('--cold_model_name',
+                        dest='cold_model_name',
+                        help='Name of the directory of the cold-start replicas.',
+                        default='supervised_aae')
+    parser.add_argument('--warm_model_name',
+                        dest='warm_model_name',
+                        help='Name of the directory of the warm-start replicas.',
+                        default='supervised_aae_warm_start')
+    args = parser.parse_args()
+
+    main(args.dataset_name, args.disease_label, args.n_bootstrap, args.cold_model_name, args.warm_model_name)
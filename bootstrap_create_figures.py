@@ -9,6 +9,7 @@ import matplotlib.pyplot as plt
 import numpy as np
 from tqdm import tqdm
 
+from deviation_store import DeviationStore
 from utils import load_dataset
 
 PROJECT_ROOT = Path.cwd()
@@ -30,14 +31,14 @@ def main():
     ids_path = PROJECT_ROOT / 'outputs' / (dataset_name + '_homogeneous_ids.csv')
     adni_df = load_dataset(participants_path, ids_path, freesurfer_path)
 
+    store = DeviationStore(model_dir / dataset_name)
+    subject_indices = store.subject_indices(adni_df['participant_id'])
+    reconstruction_error = store.reconstruction_error[:, subject_indices].astype('float64')
+
     mean_adni_list = []
 
     for i_bootstrap in tqdm(range(n_bootstrap)):
-        bootstrap_model_dir = model_dir / '{:03d}'.format(i_bootstrap)
-        output_dataset_dir = bootstrap_model_dir / dataset_name
-        output_dataset_dir.mkdir(exist_ok=True)
-
-        reconstruction_error_df = pd.read_csv(output_dataset_dir / 'reconstruction_error.csv')
+        reconstruction_error_df = pd.DataFrame({'Reconstruction error': reconstruction_error[i_bootstrap]})
 
         error_hc = reconstruction_error_df.loc[adni_df['Diagn'] == 1]['Reconstruction error']
         error_emci = reconstruction_error_df.loc[adni_df['Diagn'] == 27]['Reconstruction error']
@@ -80,14 +81,14 @@ def main():
     ids_path = PROJECT_ROOT / 'outputs' / (dataset_name + '_homogeneous_ids.csv')
     brescia_df = load_dataset(participants_path, ids_path, freesurfer_path)
 
+    store = DeviationStore(model_dir / dataset_name)
+    subject_indices = store.subject_indices(brescia_df['participant_id'])
+    reconstruction_error = store.reconstruction_error[:, subject_indices].astype('float64')
+
     mean_brescia_list = []
 
     for i_bootstrap in tqdm(range(n_bootstrap)):
-        bootstrap_model_dir = model_dir / '{:03d}'.format(i_bootstrap)
-        output_dataset_dir = bootstrap_model_dir / dataset_name
-        output_dataset_dir.mkdir(exist_ok=True)
-
-        reconstruction_error_df = pd.read_csv(output_dataset_dir / 'reconstruction_error.csv')
+        reconstruction_error_df = pd.DataFrame({'Reconstruction error': reconstruction_error[i_bootstrap]})
 
         error_hc = reconstruction_error_df.loc[brescia_df['Diagn'] == 1]['Reconstruction error']
         error_mci = reconstruction_error_df.loc[brescia_df['Diagn'] == 18]['Reconstruction error']
@@ -127,14 +128,14 @@ def main():
     ids_path = PROJECT_ROOT / 'outputs' / (dataset_name + '_homogeneous_ids.csv')
     brescia_df = load_dataset(participants_path, ids_path, freesurfer_path)
 
+    store = DeviationStore(model_dir / dataset_name)
+    subject_indices = store.subject_indices(brescia_df['participant_id'])
+    reconstruction_error = store.reconstruction_error[:, subject_indices].astype('float64')
+
     mean_brescia_list = []
 
     for i_bootstrap in tqdm(range(n_bootstrap)):
-        bootstrap_model_dir = model_dir / '{:03d}'.format(i_bootstrap)
-        output_dataset_dir = bootstrap_model_dir / dataset_name
-        output_dataset_dir.mkdir(exist_ok=True)
-
-        reconstruction_error_df = pd.read_csv(output_dataset_dir / 'reconstruction_error.csv')
+        reconstruction_error_df = pd.DataFrame({'Reconstruction error': reconstruction_error[i_bootstrap]})
 
         error_hc = reconstruction_error_df.loc[brescia_df['Diagn'] == 1]['Reconstruction error']
         error_mci = reconstruction_error_df.loc[brescia_df['Diagn'] == 18]['Reconstruction error']
@@ -175,14 +176,14 @@ def main():
     ids_path = PROJECT_ROOT / 'outputs' / (dataset_name + '_homogeneous_ids.csv')
     oasis1_df = load_dataset(participants_path, ids_path, freesurfer_path)
 
+    store = DeviationStore(model_dir / dataset_name)
+    subject_indices = store.subject_indices(oasis1_df['participant_id'])
+    reconstruction_error = store.reconstruction_error[:, subject_indices].astype('float64')
+
     mean_oasis1_list = []
 
     for i_bootstrap in tqdm(range(n_bootstrap)):
-        bootstrap_model_dir = model_dir / '{:03d}'.format(i_bootstrap)
-        output_dataset_dir = bootstrap_model_dir / dataset_name
-        output_dataset_dir.mkdir(exist_ok=True)
-
-        reconstruction_error_df = pd.read_csv(output_dataset_dir / 'reconstruction_error.csv')
+        reconstruction_error_df = pd.DataFrame({'Reconstruction error': reconstruction_error[i_bootstrap]})
 
         error_hc = reconstruction_error_df.loc[oasis1_df['Diagn'] == 1]['Reconstruction error']
         error_ad = reconstruction_error_df.loc[oasis1_df['Diagn'] == 17]['Reconstruction error']
@@ -218,14 +219,14 @@ def main():
     ids_path = PROJECT_ROOT / 'outputs' / (dataset_name + '_homogeneous_ids.csv')
     oasis1_df = load_dataset(participants_path, ids_path, freesurfer_path)
 
+    store = DeviationStore(model_dir / dataset_name)
+    subject_indices = store.subject_indices(oasis1_df['participant_id'])
+    reconstruction_error = store.reconstruction_error[:, subject_indices].astype('float64')
+
     mean_oasis1_list = []
 
     for i_bootstrap in tqdm(range(n_bootstrap)):
-        bootstrap_model_dir = model_dir / '{:03d}'.format(i_bootstrap)
-        output_dataset_dir = bootstrap_model_dir / dataset_name
-        output_dataset_dir.mkdir(exist_ok=True)
-
-        reconstruction_error_df = pd.read_csv(output_dataset_dir / 'reconstruction_error.csv')
+        reconstruction_error_df = pd.DataFrame({'Reconstruction error': reconstruction_error[i_bootstrap]})
 
         error_hc = reconstruction_error_df.loc[oasis1_df['Diagn'] == 1]['Reconstruction error']
         error_ad = reconstruction_error_df.loc[oasis1_df['Diagn'] == 17]['Reconstruction error']
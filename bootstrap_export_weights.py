@@ -0,0 +1,39 @@
+#!/usr/bin/env python3
+"""Script to export the bootstrap replicas to .npz archives that can be scored without TensorFlow.
+
+Each archive has the weights of the encoder and the decoder, the parameters of the scaler and the categories of the
+demographic data encoders of a replica, and the names of the brain regions of its inputs (see inference.py).
+"""
+import argparse
+from pathlib import Path
+
+from tqdm import tqdm
+
+from inference import load_replica, save_replica_npz
+from utils import COLUMNS_NAME
+
+PROJECT_ROOT = Path.cwd()
+
+
+def main(model_name):
+    """Export the weights of each bootstrap replica to the weights.npz file of its directory."""
+    # ----------------------------------------------------------------------------
+    n_bootstrap = 1000
+
+    model_dir = PROJECT_ROOT / 'outputs' / 'bootstrap_analysis' / model_name
+
+    # ----------------------------------------------------------------------------
+    for i_bootstrap in tqdm(range(n_bootstrap)):
+        bootstrap_model_dir = model_dir / '{:03d}'.format(i_bootstrap)
+        save_replica_npz(bootstrap_model_dir / 'weights.npz', load_replica(bootstrap_model_dir), COLUMNS_NAME)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-M', '--model_name',
+                        dest='model_name',
+                        help='Name of the directory of the trained models.',
+                        default='supervised_aae')
+    args = parser.parse_args()
+
+    main(args.model_name)
@@ -9,33 +9,31 @@ References:
     https://stats.stackexchange.com/questions/186337/average-roc-for-repeated-10-fold-cross-validation-with-probability-estimates
 """
 import argparse
+import hashlib
 from pathlib import Path
 
 import pandas as pd
 import matplotlib.pyplot as plt
 import numpy as np
-from scipy import stats
-from sklearn.metrics import roc_curve, auc
 from tqdm import tqdm
 
-from utils import COLUMNS_NAME, load_dataset, cliff_delta
+from deviation_store import DeviationStore
+from pipeline import AsyncWriter, PipelineStats, prefetch
+from utils import COLUMNS_NAME, load_dataset, rank_sum_test, roc_curves
 
 PROJECT_ROOT = Path.cwd()
 
 
 def compute_brain_regions_deviations(diff_df, clinical_df, disease_label, hc_label=1):
     """ Calculate the Cliff's delta effect size between groups."""
-    region_df = pd.DataFrame(columns=['regions', 'pvalue', 'effect_size'])
-
     diff_hc = diff_df.loc[clinical_df['Diagn'] == disease_label]
     diff_patient = diff_df.loc[clinical_df['Diagn'] == hc_label]
 
-    for region in COLUMNS_NAME:
-        _, pvalue = stats.mannwhitneyu(diff_hc[region], diff_patient[region])
-        effect_size = cliff_delta(diff_hc[region].values, diff_patient[region].values)
+    # Mann-Whitney U tests and effect sizes of all the regions from the same ranks
+    _, pvalues, effect_sizes = rank_sum_test(diff_hc[COLUMNS_NAME].values, diff_patient[COLUMNS_NAME].values)
 
-        region_df = region_df.append({'regions': region, 'pvalue': pvalue, 'effect_size': effect_size},
-                                     ignore_index=True)
+    region_df = pd.DataFrame({'regions': COLUMNS_NAME, 'pvalue': pvalues, 'effect_size': effect_sizes},
+                             columns=['regions', 'pvalue', 'effect_size'])
 
     return region_df
 
@@ -45,88 +43,30 @@ def compute_classification_performance(reconstruction_error_df, clinical_df, dis
     error_hc = reconstruction_error_df.loc[clinical_df['Diagn'] == hc_label]['Reconstruction error']
     error_patient = reconstruction_error_df.loc[clinical_df['Diagn'] == disease_label]['Reconstruction error']
 
-    fpr, tpr, _ = roc_curve(list(np.zeros_like(error_hc)) + list(np.ones_like(error_patient)),
-                            list(error_hc) + list(error_patient))
-
-    roc_auc = auc(fpr, tpr)
-
-    tpr = np.interp(np.linspace(0, 1, 101), fpr, tpr)
-
-    tpr[0] = 0.0
+    roc_auc, tpr = roc_curves(error_hc.values, error_patient.values)
 
     return roc_auc, tpr
 
 
-def main(dataset_name, disease_label):
-    """Perform the group analysis."""
-    # ----------------------------------------------------------------------------
-    n_bootstrap = 1000
-
-    model_name = 'supervised_aae'
-
-    participants_path = PROJECT_ROOT / 'data' / dataset_name / 'participants.tsv'
-    freesurfer_path = PROJECT_ROOT / 'data' / dataset_name / 'freesurferData.csv'
-
-    hc_label = 1
-
-    # ----------------------------------------------------------------------------
-    bootstrap_dir = PROJECT_ROOT / 'outputs' / 'bootstrap_analysis'
-    model_dir = bootstrap_dir / model_name
-    ids_path = PROJECT_ROOT / 'outputs' / (dataset_name + '_homogeneous_ids.csv')
-
-    # ----------------------------------------------------------------------------
-    clinical_df = load_dataset(participants_path, ids_path, freesurfer_path)
-    clinical_df = clinical_df.set_index('participant_id')
-
-    tpr_list = []
-    auc_roc_list = []
-    effect_size_list = []
-
-    for i_bootstrap in tqdm(range(n_bootstrap)):
-        bootstrap_model_dir = model_dir / '{:03d}'.format(i_bootstrap)
-
-        output_dataset_dir = bootstrap_model_dir / dataset_name
-        output_dataset_dir.mkdir(exist_ok=True)
-
-        analysis_dir = output_dataset_dir / '{:02d}_vs_{:02d}'.format(hc_label, disease_label)
-        analysis_dir.mkdir(exist_ok=True)
-
-        # ----------------------------------------------------------------------------
-        normalized_df = pd.read_csv(output_dataset_dir / 'normalized.csv', index_col='participant_id')
-        reconstruction_df = pd.read_csv(output_dataset_dir / 'reconstruction.csv', index_col='participant_id')
-        reconstruction_error_df = pd.read_csv(output_dataset_dir / 'reconstruction_error.csv',
-                                              index_col='participant_id')
-
-        # ----------------------------------------------------------------------------
-        # Compute effect size of the brain regions for the bootstrap iteration
-        diff_df = np.abs(normalized_df - reconstruction_df)
-        region_df = compute_brain_regions_deviations(diff_df, clinical_df, disease_label)
-        effect_size_list.append(region_df['effect_size'].values)
-        region_df.to_csv(analysis_dir / 'regions_analysis.csv', index=False)
-
-        # ----------------------------------------------------------------------------
-        # Compute AUC-ROC for the bootstrap iteration
-        roc_auc, tpr = compute_classification_performance(reconstruction_error_df, clinical_df, disease_label)
-        auc_roc_list.append(roc_auc)
-        tpr_list.append(tpr)
+def load_cache(cache_path, n_bootstrap):
+    """Load the hashes of the inputs and the results of the regions analysis of each bootstrap iteration."""
+    cache = {'input_hash': np.full(n_bootstrap, '', dtype='U40'),
+             'pvalue': np.zeros((n_bootstrap, len(COLUMNS_NAME))),
+             'effect_size': np.zeros((n_bootstrap, len(COLUMNS_NAME)))}
 
-    (bootstrap_dir / dataset_name).mkdir(exist_ok=True)
-    comparison_dir = bootstrap_dir / dataset_name / ('{:02d}_vs_{:02d}'.format(hc_label, disease_label))
-    comparison_dir.mkdir(exist_ok=True)
+    if cache_path.exists():
+        with np.load(cache_path) as archive:
+            n_cached = min(n_bootstrap, len(archive['input_hash']))
+            for name in cache:
+                cache[name][:n_cached] = archive[name][:n_cached]
 
-    # ----------------------------------------------------------------------------
-    # Save regions effect sizes
-    effect_size_df = pd.DataFrame(columns=COLUMNS_NAME, data=np.array(effect_size_list))
-    effect_size_df.to_csv(comparison_dir / 'effect_size.csv')
+    return cache
 
-    # Save AUC bootstrap values
-    auc_roc_list = np.array(auc_roc_list)
-    auc_roc_df = pd.DataFrame(columns=['AUC-ROC'], data=auc_roc_list)
-    auc_roc_df.to_csv(comparison_dir / 'auc_rocs.csv', index=False)
 
+def create_figures(comparison_dir, effect_size_df, auc_roc_list, tpr_list):
+    """Create the figures of a contrast from the effect sizes and the ROC curves of the bootstrap iterations."""
     # ----------------------------------------------------------------------------
     # Create Figure 3 of the paper
-    tpr_list = np.array(tpr_list)
     mean_tprs = tpr_list.mean(axis=0)
     tprs_upper = np.percentile(tpr_list, 97.5, axis=0)
     tprs_lower = np.percentile(tpr_list, 2.5, axis=0)
@@ -199,15 +139,137 @@ def main(dataset_name, disease_label):
     plt.clf()
 
 
+def main(dataset_name, disease_labels, use_cache=True):
+    """Perform the group analysis of each disease label against the healthy controls.
+
+    The deviations of each bootstrap iteration are read once and used by all the contrasts.
+
+    The regions analysis of a bootstrap iteration is only recomputed if the hash of its inputs (the deviations, the
+    diagnoses and the contrast) differs from the one saved in the cache of the contrast, e.g. after retraining some
+    replicas.
+    """
+    # ----------------------------------------------------------------------------
+    n_bootstrap = 1000
+
+    model_name = 'supervised_aae'
+
+    participants_path = PROJECT_ROOT / 'data' / dataset_name / 'participants.tsv'
+    freesurfer_path = PROJECT_ROOT / 'data' / dataset_name / 'freesurferData.csv'
+
+    hc_label = 1
+
+    # ----------------------------------------------------------------------------
+    bootstrap_dir = PROJECT_ROOT / 'outputs' / 'bootstrap_analysis'
+    model_dir = bootstrap_dir / model_name
+    ids_path = PROJECT_ROOT / 'outputs' / (dataset_name + '_homogeneous_ids.csv')
+
+    # ----------------------------------------------------------------------------
+    clinical_df = load_dataset(participants_path, ids_path, freesurfer_path)
+    clinical_df = clinical_df.set_index('participant_id')
+
+    store = DeviationStore(model_dir / dataset_name)
+    subject_indices = store.subject_indices(clinical_df.index)
+
+    def load_deviations(i_bootstrap):
+        """Read the deviations of a replica from the store (run on the prefetching threads)."""
+        normalized = store.normalized[i_bootstrap, subject_indices].astype('float64')
+        reconstruction = store.reconstruction[i_bootstrap, subject_indices].astype('float64')
+
+        diff = np.abs(normalized - reconstruction)
+
+        return pd.DataFrame(diff, index=clinical_df.index, columns=store.regions), hashlib.sha1(diff.tobytes())
+
+    diagnoses = clinical_df['Diagn'].values.astype('int64')
+
+    comparison_dirs = {}
+    caches = {}
+    for disease_label in disease_labels:
+        comparison_dir = bootstrap_dir / dataset_name / ('{:02d}_vs_{:02d}'.format(hc_label, disease_label))
+        comparison_dir.mkdir(parents=True, exist_ok=True)
+
+        comparison_dirs[disease_label] = comparison_dir
+        caches[disease_label] = load_cache(comparison_dir / 'regions_analysis_cache.npz', n_bootstrap)
+
+    n_cached = 0
+
+    loading_stats = PipelineStats('loading')
+    writing_stats = PipelineStats('writing')
+
+    with AsyncWriter(stats=writing_stats) as writer:
+        replicas = prefetch(load_deviations, range(n_bootstrap), stats=loading_stats)
+        for i_bootstrap, (diff_df, diff_hash) in tqdm(replicas, total=n_bootstrap):
+            bootstrap_model_dir = model_dir / '{:03d}'.format(i_bootstrap)
+
+            output_dataset_dir = bootstrap_model_dir / dataset_name
+            output_dataset_dir.mkdir(exist_ok=True)
+
+            for disease_label in disease_labels:
+                analysis_dir = output_dataset_dir / '{:02d}_vs_{:02d}'.format(hc_label, disease_label)
+                analysis_dir.mkdir(exist_ok=True)
+
+                input_hash = diff_hash.copy()
+                input_hash.update(diagnoses.tobytes())
+                input_hash.update('{:d}_vs_{:d}'.format(hc_label, disease_label).encode())
+                input_hash = input_hash.hexdigest()
+
+                cache = caches[disease_label]
+                if (use_cache and cache['input_hash'][i_bootstrap] == input_hash and
+                        (analysis_dir / 'regions_analysis.csv').exists()):
+                    n_cached += 1
+                    continue
+
+                # ----------------------------------------------------------------------------
+                # Compute effect size of the brain regions for the bootstrap iteration
+                region_df = compute_brain_regions_deviations(diff_df, clinical_df, disease_label)
+                cache['input_hash'][i_bootstrap] = input_hash
+                cache['pvalue'][i_bootstrap] = region_df['pvalue'].values
+                cache['effect_size'][i_bootstrap] = region_df['effect_size'].values
+                writer.submit(region_df.to_csv, analysis_dir / 'regions_analysis.csv', index=False)
+
+    print(loading_stats.summary())
+    print(writing_stats.summary())
+    print('CACHED: {:d} of {:d}'.format(n_cached, n_bootstrap * len(disease_labels)))
+
+    for disease_label in disease_labels:
+        np.savez(comparison_dirs[disease_label] / 'regions_analysis_cache.npz', **caches[disease_label])
+
+    reconstruction_error = store.reconstruction_error[:n_bootstrap]
+    hc_indices = subject_indices[(clinical_df['Diagn'] == hc_label).values]
+
+    for disease_label in disease_labels:
+        # ----------------------------------------------------------------------------
+        # Compute AUC-ROC of all the bootstrap iterations at once
+        patient_indices = subject_indices[(clinical_df['Diagn'] == disease_label).values]
+        auc_roc_list, tpr_list = roc_curves(reconstruction_error[:, hc_indices],
+                                            reconstruction_error[:, patient_indices])
+
+        comparison_dir = comparison_dirs[disease_label]
+
+        # ----------------------------------------------------------------------------
+        # Save regions effect sizes
+        effect_size_df = pd.DataFrame(columns=COLUMNS_NAME, data=caches[disease_label]['effect_size'])
+        effect_size_df.to_csv(comparison_dir / 'effect_size.csv')
+
+        # Save AUC bootstrap values
+        auc_roc_df = pd.DataFrame(columns=['AUC-ROC'], data=auc_roc_list)
+        auc_roc_df.to_csv(comparison_dir / 'auc_rocs.csv', index=False)
+
+        create_figures(comparison_dir, effect_size_df, auc_roc_list, tpr_list)
+
+
 if __name__ == "__main__":
     parser = argparse.ArgumentParser()
     parser.add_argument('-D', '--dataset_name',
                         dest='dataset_name',
                         help='Dataset name to perform group analysis.')
-    parser.add_argument('-L', '--disease_label',
-                        dest='disease_label',
-                        help='Disease label to perform group analysis.',
-                        type=int)
+    parser.add_argument('-L', '--disease_labels',
+                        dest='disease_labels',
+                        help='Disease labels to perform group analysis (one contrast against the controls per label).',
+                        nargs='+', type=int)
+    parser.add_argument('--no_cache',
+                        dest='use_cache',
+                        help='Recompute the regions analysis of all the bootstrap iterations.',
+                        action='store_false')
     args = parser.parse_args()
 
-    main(args.dataset_name, args.disease_label)
+    main(args.dataset_name, args.disease_labels, args.use_cache)
@@ -6,8 +6,8 @@ from itertools import combinations
 
 import pandas as pd
 import numpy as np
-from tqdm import tqdm
 
+from deviation_store import DeviationStore
 from utils import load_dataset
 
 PROJECT_ROOT = Path.cwd()
@@ -29,40 +29,34 @@ def main(dataset_name, label_list):
     bootstrap_dir = PROJECT_ROOT / 'outputs' / 'bootstrap_analysis'
     model_dir = bootstrap_dir / model_name
 
-    reconstruction_error_list_df = pd.DataFrame(clinical_df['participant_id'])
     clinical_df = clinical_df.set_index('participant_id')
 
-    for i_bootstrap in tqdm(range(n_bootstrap)):
-        bootstrap_model_dir = model_dir / '{:03d}'.format(i_bootstrap)
+    store = DeviationStore(model_dir / dataset_name)
+    subject_indices = store.subject_indices(clinical_df.index)
 
-        output_dataset_dir = bootstrap_model_dir / dataset_name
-        output_dataset_dir.mkdir(exist_ok=True)
+    # Reconstruction errors with shape [subject, replica]
+    reconstruction_error = np.ascontiguousarray(store.reconstruction_error[:n_bootstrap, subject_indices].T)
 
-        # ----------------------------------------------------------------------------
-        reconstruction_error_df = pd.read_csv(output_dataset_dir / 'reconstruction_error.csv')
-        reconstruction_error_list_df['Reconstruction error {:d}'.format(i_bootstrap)] = reconstruction_error_df[
-            'Reconstruction error'].values
+    # Mean reconstruction error of each group for each bootstrap replica, with shape [group, replica]
+    membership = (clinical_df['Diagn'].values == np.array(label_list)[:, np.newaxis]).astype('float64')
+    group_means = np.dot(membership / membership.sum(axis=1, keepdims=True), reconstruction_error.astype('float64'))
 
-    reconstruction_error_list_df = reconstruction_error_list_df.set_index('participant_id')
+    # Confidence intervals of the differences of all the pairs of groups
+    pairs = list(combinations(range(len(label_list)), 2))
+    first_groups = np.array([i_group1 for i_group1, _ in pairs], dtype=int)
+    second_groups = np.array([i_group2 for _, i_group2 in pairs], dtype=int)
+    lower, upper = np.percentile(group_means[first_groups] - group_means[second_groups], [2.5, 97.5], axis=1)
 
-    hypothesis_df = pd.DataFrame()
-    for group_labels in combinations(label_list, 2):
-        mean_group1 = np.mean(reconstruction_error_list_df.loc[clinical_df['Diagn'] == group_labels[0]].values, axis=0)
-        mean_group2 = np.mean(reconstruction_error_list_df.loc[clinical_df['Diagn'] == group_labels[1]].values, axis=0)
+    hypothesis_list = []
+    for i_pair, (i_group1, i_group2) in enumerate(pairs):
+        print(lower[i_pair])
+        print(upper[i_pair])
 
-        print(np.percentile(mean_group1 - mean_group2, 2.5))
-        print(np.percentile(mean_group1 - mean_group2, 97.5))
-
-        hypothesis_df = hypothesis_df.append({'comparison': '{}_vs_{}'.format(group_labels[0], group_labels[1]),
-                                              'measure': 'Lower',
-                                              'value': np.percentile(mean_group1 - mean_group2, 2.5)},
-                                             ignore_index=True)
-
-        hypothesis_df = hypothesis_df.append({'comparison': '{}_vs_{}'.format(group_labels[0], group_labels[1]),
-                                              'measure': 'Upper',
-                                              'value': np.percentile(mean_group1 - mean_group2, 97.5)},
-                                             ignore_index=True)
+        comparison = '{}_vs_{}'.format(label_list[i_group1], label_list[i_group2])
+        hypothesis_list.append({'comparison': comparison, 'measure': 'Lower', 'value': lower[i_pair]})
+        hypothesis_list.append({'comparison': comparison, 'measure': 'Upper', 'value': upper[i_pair]})
 
+    hypothesis_df = pd.DataFrame(hypothesis_list, columns=['comparison', 'measure', 'value'])
     hypothesis_df.to_csv(bootstrap_dir / dataset_name / 'hypothesis_test.csv')
 
 
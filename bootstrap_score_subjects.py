@@ -0,0 +1,94 @@
+#!/usr/bin/env python3
+"""Script to compute the deviation scores of new subjects with the exported bootstrap replicas.
+
+It only needs NumPy: the replicas are read from the .npz archives created by bootstrap_export_weights.py.
+The input files have the format of the templates of notebooks/predict.ipynb.
+"""
+import argparse
+import csv
+from pathlib import Path
+
+import numpy as np
+
+from inference import StackedAAE, load_regions_npz, load_replica_npz
+
+PROJECT_ROOT = Path.cwd()
+
+
+def read_table(table_path, delimiter=','):
+    """Read the rows of a CSV (or TSV) file as dictionaries (pandas takes longer to import than to score a subject)."""
+    with open(table_path, newline='') as table_file:
+        return list(csv.DictReader(table_file, delimiter=delimiter))
+
+
+def main(freesurfer_path, participants_path, output_path, model_name, n_bootstrap, chunk_size=100):
+    """Compute the reconstruction error of each subject with each replica and their mean."""
+    model_dir = PROJECT_ROOT / 'outputs' / 'bootstrap_analysis' / model_name
+
+    # ----------------------------------------------------------------------------
+    # Subjects of the FreeSurfer file with demographic data, in the order of the FreeSurfer file
+    participants = {row['Participant_ID']: row for row in read_table(participants_path, delimiter='\t')}
+    dataset_rows = [dict(participants[row['Participant_ID']], **row) for row in read_table(freesurfer_path)
+                    if row['Participant_ID'] in participants]
+
+    # The brain regions are read from the archives, so this script does not need the analysis modules
+    regions = load_regions_npz(model_dir / '000' / 'weights.npz')
+    x_dataset = np.array([[float(row[region]) for region in regions] for row in dataset_rows])
+
+    tiv = np.array([float(row['EstimatedTotalIntraCranialVol']) for row in dataset_rows])
+    tiv = tiv[:, np.newaxis]
+
+    x_dataset = (np.true_divide(x_dataset, tiv)).astype('float32')
+
+    # The ages are clipped to the range of the UK Biobank ages
+    age = np.clip(np.array([float(row['Age']) for row in dataset_rows]), 47, 73).astype('float32')
+    gender = np.array([float(row['Gender']) for row in dataset_rows]).astype('float32')
+
+    # ----------------------------------------------------------------------------
+    reconstruction_errors = []
+    for i_start in range(0, n_bootstrap, chunk_size):
+        i_bootstraps = range(i_start, min(i_start + chunk_size, n_bootstrap))
+
+        ensemble = StackedAAE([load_replica_npz(model_dir / '{:03d}'.format(i_bootstrap) / 'weights.npz')
+                               for i_bootstrap in i_bootstraps])
+        x_normalized, _, reconstruction = ensemble.predict(x_dataset, age, gender)
+
+        reconstruction_errors.append(np.mean((x_normalized - reconstruction) ** 2, axis=2))
+
+    reconstruction_errors = np.concatenate(reconstruction_errors)
+
+    mean_reconstruction_error = reconstruction_errors.mean(axis=0)
+
+    with open(output_path, 'w', newline='') as output_file:
+        writer = csv.writer(output_file, lineterminator='\n')
+        writer.writerow(['Participant_ID'] +
+                        ['Reconstruction error {:03d}'.format(i_bootstrap) for i_bootstrap in range(n_bootstrap)] +
+                        ['Mean reconstruction error'])
+        for i_subject, row in enumerate(dataset_rows):
+            writer.writerow([row['Participant_ID']] +
+                            [str(value) for value in reconstruction_errors[:, i_subject]] +
+                            [str(mean_reconstruction_error[i_subject])])
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-F', '--freesurfer_path',
+                        dest='freesurfer_path',
+                        help='Path of the freesurferData.csv file of the subjects.')
+    parser.add_argument('-P', '--participants_path',
+                        dest='participants_path',
+                        help='Path of the participants.tsv file of the subjects.')
+    parser.add_argument('-O', '--output_path',
+                        dest='output_path',
+                        help='Path of the output file with the deviation scores.',
+                        default='reconstruction_error.csv')
+    parser.add_argument('-M', '--model_name',
+                        dest='model_name',
+                        help='Name of the directory of the trained models.',
+                        default='supervised_aae')
+    parser.add_argument('-N', '--n_bootstrap',
+                        dest='n_bootstrap',
+                        help='Number of bootstrap replicas used.',
+                        type=int, default=1000)
+    args = parser.parse_args()
+
+    main(args.freesurfer_path, args.participants_path, args.output_path, args.model_name, args.n_bootstrap)
@@ -3,111 +3,154 @@
 import argparse
 from pathlib import Path
 
-import joblib
 import numpy as np
 import pandas as pd
-import tensorflow as tf
-from tensorflow import keras
 from tqdm import tqdm
 
+from deviation_store import DeviationStore
+from inference import StackedAAE, load_replica
+from pipeline import AsyncWriter, PipelineStats, prefetch
 from utils import COLUMNS_NAME, load_dataset
 
 PROJECT_ROOT = Path.cwd()
 
 
-def main(dataset_name):
-    """Make predictions using trained normative models."""
-    # ----------------------------------------------------------------------------
-    n_bootstrap = 1000
-    model_name = 'supervised_aae'
+def save_replica_outputs(output_dataset_dir, participant_id, x_normalized, reconstruction, encoded):
+    """Save the normalized data, the reconstruction, the latent code and the reconstruction error of a replica."""
+    normalized_df = pd.DataFrame(columns=['participant_id'] + COLUMNS_NAME)
+    normalized_df['participant_id'] = participant_id
+    normalized_df[COLUMNS_NAME] = x_normalized
+    normalized_df.to_csv(output_dataset_dir / 'normalized.csv', index=False)
+
+    reconstruction_df = pd.DataFrame(columns=['participant_id'] + COLUMNS_NAME)
+    reconstruction_df['participant_id'] = participant_id
+    reconstruction_df[COLUMNS_NAME] = reconstruction
+    reconstruction_df.to_csv(output_dataset_dir / 'reconstruction.csv', index=False)
+
+    encoded_df = pd.DataFrame(columns=['participant_id'] + list(range(encoded.shape[1])))
+    encoded_df['participant_id'] = participant_id
+    encoded_df[list(range(encoded.shape[1]))] = encoded
+    encoded_df.to_csv(output_dataset_dir / 'encoded.csv', index=False)
+
+    reconstruction_error = np.mean((x_normalized - reconstruction) ** 2, axis=1)
+
+    reconstruction_error_df = pd.DataFrame(columns=['participant_id', 'Reconstruction error'])
+    reconstruction_error_df['participant_id'] = participant_id
+    reconstruction_error_df['Reconstruction error'] = reconstruction_error
+    reconstruction_error_df.to_csv(output_dataset_dir / 'reconstruction_error.csv', index=False)
+
 
+def load_clinical_data(dataset_name):
+    """Load the ids, the brain regions (divided by the total intracranial volume) and demographic data of a dataset."""
     participants_path = PROJECT_ROOT / 'data' / dataset_name / 'participants.tsv'
     freesurfer_path = PROJECT_ROOT / 'data' / dataset_name / 'freesurferData.csv'
+    ids_path = PROJECT_ROOT / 'outputs' / (dataset_name + '_homogeneous_ids.csv')
 
-    # ----------------------------------------------------------------------------
-    # Create directories structure
-    outputs_dir = PROJECT_ROOT / 'outputs'
-    bootstrap_dir = outputs_dir / 'bootstrap_analysis'
-    model_dir = bootstrap_dir / model_name
-    ids_path = outputs_dir / (dataset_name + '_homogeneous_ids.csv')
+    clinical_df = load_dataset(participants_path, ids_path, freesurfer_path)
 
-    # ----------------------------------------------------------------------------
-    # Set random seed
-    random_seed = 42
-    tf.random.set_seed(random_seed)
-    np.random.seed(random_seed)
+    x_dataset = clinical_df[COLUMNS_NAME].values
 
-    # ----------------------------------------------------------------------------
-    for i_bootstrap in tqdm(range(n_bootstrap)):
-        bootstrap_model_dir = model_dir / '{:03d}'.format(i_bootstrap)
+    tiv = clinical_df['EstimatedTotalIntraCranialVol'].values
+    tiv = tiv[:, np.newaxis]
 
-        output_dataset_dir = bootstrap_model_dir / dataset_name
-        output_dataset_dir.mkdir(exist_ok=True)
+    x_dataset = (np.true_divide(x_dataset, tiv)).astype('float32')
 
-        # ----------------------------------------------------------------------------
-        # Loading data
-        clinical_df = load_dataset(participants_path, ids_path, freesurfer_path)
+    age = clinical_df['Age'].values.astype('float32')
+    gender = clinical_df['Gender'].values.astype('float32')
 
-        x_dataset = clinical_df[COLUMNS_NAME].values
+    return clinical_df['participant_id'], x_dataset, age, gender
 
-        tiv = clinical_df['EstimatedTotalIntraCranialVol'].values
-        tiv = tiv[:, np.newaxis]
 
-        x_dataset = (np.true_divide(x_dataset, tiv)).astype('float32')
-        # ----------------------------------------------------------------------------
-        encoder = keras.models.load_model(bootstrap_model_dir / 'encoder.h5', compile=False)
-        decoder = keras.models.load_model(bootstrap_model_dir / 'decoder.h5', compile=False)
+def main(dataset_names, chunk_size=100, save_csv=False, n_workers=2, prefetch_depth=2):
+    """Make predictions using trained normative models.
 
-        scaler = joblib.load(bootstrap_model_dir / 'scaler.joblib')
+    The replicas are computed together in chunks of `chunk_size` replicas with stacked weights (see inference.py),
+    instead of loading and running the Keras models one replica at a time. Each dataset is loaded once and each
+    replica is loaded once for all the datasets.
 
-        enc_age = joblib.load(bootstrap_model_dir / 'age_encoder.joblib')
-        enc_gender = joblib.load(bootstrap_model_dir / 'gender_encoder.joblib')
+    The outputs of each dataset are written in a DeviationStore (see deviation_store.py) in `model_dir / dataset_name`.
+    The CSV files of each replica are only written with `save_csv`.
 
-        # ----------------------------------------------------------------------------
-        x_normalized = scaler.transform(x_dataset)
+    The next `prefetch_depth` chunks are loaded by `n_workers` threads and the outputs are written by another thread
+    while the current chunk is computed (see pipeline.py).
+    """
+    # ----------------------------------------------------------------------------
+    n_bootstrap = 1000
+    model_name = 'supervised_aae'
+
+    # ----------------------------------------------------------------------------
+    # Create directories structure
+    outputs_dir = PROJECT_ROOT / 'outputs'
+    bootstrap_dir = outputs_dir / 'bootstrap_analysis'
+    model_dir = bootstrap_dir / model_name
+
+    # ----------------------------------------------------------------------------
+    # Loading data
+    datasets = {dataset_name: load_clinical_data(dataset_name) for dataset_name in dataset_names}
 
-        normalized_df = pd.DataFrame(columns=['participant_id'] + COLUMNS_NAME)
-        normalized_df['participant_id'] = clinical_df['participant_id']
-        normalized_df[COLUMNS_NAME] = x_normalized
-        normalized_df.to_csv(output_dataset_dir / 'normalized.csv', index=False)
+    stores = {}
 
-        # ----------------------------------------------------------------------------
-        age = clinical_df['Age'].values[:, np.newaxis].astype('float32')
-        one_hot_age = enc_age.transform(age)
+    def load_chunk(i_start):
+        i_bootstraps = range(i_start, min(i_start + chunk_size, n_bootstrap))
+        return StackedAAE([load_replica(model_dir / '{:03d}'.format(i_bootstrap)) for i_bootstrap in i_bootstraps])
+
+    loading_stats = PipelineStats('loading')
+    writing_stats = PipelineStats('writing')
+
+    # ----------------------------------------------------------------------------
+    chunk_starts = range(0, n_bootstrap, chunk_size)
+    with AsyncWriter(stats=writing_stats) as writer:
+        for i_start, ensemble in tqdm(prefetch(load_chunk, chunk_starts, n_workers, prefetch_depth, loading_stats),
+                                      total=len(chunk_starts)):
+            i_bootstraps = range(i_start, min(i_start + chunk_size, n_bootstrap))
 
-        gender = clinical_df['Gender'].values[:, np.newaxis].astype('float32')
-        one_hot_gender = enc_gender.transform(gender)
+            for dataset_name, (participant_id, x_dataset, age, gender) in datasets.items():
+                x_normalized, encoded, reconstruction = ensemble.predict(x_dataset, age, gender)
 
-        y_data = np.concatenate((one_hot_age, one_hot_gender), axis=1).astype('float32')
+                if dataset_name not in stores:
+                    stores[dataset_name] = DeviationStore.create(model_dir / dataset_name, participant_id,
+                                                                 COLUMNS_NAME, n_bootstrap, ensemble.z_dim)
+                writer.submit(stores[dataset_name].write, i_start, x_normalized, encoded, reconstruction)
 
-        # ----------------------------------------------------------------------------
-        encoded = encoder(x_normalized, training=False)
-        reconstruction = decoder(tf.concat([encoded, y_data], axis=1), training=False)
+                if not save_csv:
+                    continue
 
-        reconstruction_df = pd.DataFrame(columns=['participant_id'] + COLUMNS_NAME)
-        reconstruction_df['participant_id'] = clinical_df['participant_id']
-        reconstruction_df[COLUMNS_NAME] = reconstruction.numpy()
-        reconstruction_df.to_csv(output_dataset_dir / 'reconstruction.csv', index=False)
+                for i_member, i_bootstrap in enumerate(i_bootstraps):
+                    output_dataset_dir = model_dir / '{:03d}'.format(i_bootstrap) / dataset_name
+                    output_dataset_dir.mkdir(exist_ok=True)
 
-        encoded_df = pd.DataFrame(columns=['participant_id'] + list(range(encoded.shape[1])))
-        encoded_df['participant_id'] = clinical_df['participant_id']
-        encoded_df[list(range(encoded.shape[1]))] = encoded.numpy()
-        encoded_df.to_csv(output_dataset_dir / 'encoded.csv', index=False)
+                    writer.submit(save_replica_outputs, output_dataset_dir, participant_id,
+                                  x_normalized[i_member], reconstruction[i_member], encoded[i_member])
 
-        # ----------------------------------------------------------------------------
-        reconstruction_error = np.mean((x_normalized - reconstruction) ** 2, axis=1)
+    for store in stores.values():
+        store.flush()
 
-        reconstruction_error_df = pd.DataFrame(columns=['participant_id', 'Reconstruction error'])
-        reconstruction_error_df['participant_id'] = clinical_df['participant_id']
-        reconstruction_error_df['Reconstruction error'] = reconstruction_error
-        reconstruction_error_df.to_csv(output_dataset_dir / 'reconstruction_error.csv', index=False)
+    print(loading_stats.summary())
+    print(writing_stats.summary())
 
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser()
-    parser.add_argument('-D', '--dataset_name',
-                        dest='dataset_name',
-                        help='Dataset name to calculate deviations.')
+    parser.add_argument('-D', '--dataset_names',
+                        dest='dataset_names',
+                        help='Names of the datasets to calculate deviations.',
+                        nargs='+')
+    parser.add_argument('-C', '--chunk_size',
+                        dest='chunk_size',
+                        help='Number of replicas computed together.',
+                        type=int, default=100)
+    parser.add_argument('--save_csv',
+                        dest='save_csv',
+                        help='Also save the outputs of each replica in CSV files.',
+                        action='store_true')
+    parser.add_argument('--n_workers',
+                        dest='n_workers',
+                        help='Number of threads loading the replicas.',
+                        type=int, default=2)
+    parser.add_argument('--prefetch_depth',
+                        dest='prefetch_depth',
+                        help='Number of chunks of replicas loaded in advance.',
+                        type=int, default=2)
     args = parser.parse_args()
 
-    main(args.dataset_name)
\ No newline at end of file
+    main(args.dataset_names, args.chunk_size, args.save_csv, args.n_workers, args.prefetch_depth)
\ No newline at end of file
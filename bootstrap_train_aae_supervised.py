@@ -1,223 +1,551 @@
 #!/usr/bin/env python3
 """Script to train the deterministic supervised adversarial autoencoder."""
+import argparse
+from functools import partial
+from itertools import groupby
+import multiprocessing
 from pathlib import Path
 import random as rn
+import shutil
 import time
 
 import joblib
+import pandas as pd
 from sklearn.preprocessing import RobustScaler, OneHotEncoder
 import numpy as np
 import tensorflow as tf
+from tensorflow import keras
+from tqdm import tqdm
 
 from utils import COLUMNS_NAME, load_dataset
-from models import make_encoder_model_v1, make_decoder_model_v1, make_discriminator_model_v1
+from ensemble import EnsembleAAE
+from trainer import AAETrainer, ConvergenceMonitor, CyclicalLearningRate
 
 PROJECT_ROOT = Path.cwd()
 
+# Trainers of the current process, indexed by the shape of the data
+TRAINERS = {}
 
-def main():
-    """Train the normative method on the bootstrapped samples.
 
-    The script also the scaler and the demographic data encoder.
+def set_thread_budget(intra_op_threads=None, inter_op_threads=None):
+    """Limit the number of threads used by TensorFlow in the current process.
+
+    It needs to be called before TensorFlow executes its first operation.
     """
+    if intra_op_threads is not None:
+        tf.config.threading.set_intra_op_parallelism_threads(intra_op_threads)
+    if inter_op_threads is not None:
+        tf.config.threading.set_inter_op_parallelism_threads(inter_op_threads)
+
+
+def load_bootstrap_data(participants_path, ids_path, freesurfer_path, weighted=False):
+    """Load the bootstrapped sample and fit the scaler and the demographic data encoders.
+
+    The scaler and the encoders are always fitted on the bootstrapped sample (with its repeated subjects). When
+    `weighted` is True, each subject is returned only once, and the number of times it was sampled is returned as its
+    sample weight. Otherwise, the repeated rows are returned with unit weights.
+    """
+    dataset_df = load_dataset(participants_path, ids_path, freesurfer_path)
+
     # ----------------------------------------------------------------------------
-    n_bootstrap = 1000
-    model_name = 'supervised_aae'
+    x_data = dataset_df[COLUMNS_NAME].values
+
+    tiv = dataset_df['EstimatedTotalIntraCranialVol'].values
+    tiv = tiv[:, np.newaxis]
+
+    x_data = (np.true_divide(x_data, tiv)).astype('float32')
+
+    scaler = RobustScaler()
+    x_data_normalized = scaler.fit_transform(x_data)
 
-    participants_path = PROJECT_ROOT / 'data' / 'BIOBANK' / 'participants.tsv'
-    freesurfer_path = PROJECT_ROOT / 'data' / 'BIOBANK' / 'freesurferData.csv'
     # ----------------------------------------------------------------------------
-    bootstrap_dir = PROJECT_ROOT / 'outputs' / 'bootstrap_analysis'
-    ids_dir = bootstrap_dir / 'ids'
+    age = dataset_df['Age'].values[:, np.newaxis].astype('float32')
+    enc_age = OneHotEncoder(sparse=False)
+    one_hot_age = enc_age.fit_transform(age)
 
-    model_dir = bootstrap_dir / model_name
-    model_dir.mkdir(exist_ok=True)
+    gender = dataset_df['Gender'].values[:, np.newaxis].astype('float32')
+    enc_gender = OneHotEncoder(sparse=False)
+    one_hot_gender = enc_gender.fit_transform(gender)
+
+    y_data = np.concatenate((one_hot_age, one_hot_gender), axis=1).astype('float32')
 
     # ----------------------------------------------------------------------------
-    # Set random seed
-    random_seed = 42
-    tf.random.set_seed(random_seed)
-    np.random.seed(random_seed)
-    rn.seed(random_seed)
+    if weighted:
+        counts = dataset_df['Image_ID'].value_counts()
+        unique_mask = ~dataset_df['Image_ID'].duplicated().values
 
-    for i_bootstrap in range(n_bootstrap):
-        ids_filename = 'cleaned_bootstrap_{:03d}.csv'.format(i_bootstrap)
-        ids_path = ids_dir / ids_filename
+        x_data_normalized = x_data_normalized[unique_mask]
+        y_data = y_data[unique_mask]
+        sample_weight = counts[dataset_df['Image_ID'][unique_mask]].values.astype('float32')
+    else:
+        sample_weight = np.ones(len(dataset_df), dtype='float32')
 
-        bootstrap_model_dir = model_dir / '{:03d}'.format(i_bootstrap)
-        bootstrap_model_dir.mkdir(exist_ok=True)
+    return x_data_normalized, y_data, sample_weight, scaler, enc_age, enc_gender
 
-        # ----------------------------------------------------------------------------
-        # Loading data
-        dataset_df = load_dataset(participants_path, ids_path, freesurfer_path)
 
-        # ----------------------------------------------------------------------------
-        x_data = dataset_df[COLUMNS_NAME].values
+def save_bootstrap_replica(bootstrap_model_dir, encoder, decoder, discriminator, scaler, enc_age, enc_gender):
+    """Save the models, the scaler and the demographic data encoders of a bootstrap replica."""
+    # Save models
+    encoder.save(bootstrap_model_dir / 'encoder.h5')
+    decoder.save(bootstrap_model_dir / 'decoder.h5')
+    discriminator.save(bootstrap_model_dir / 'discriminator.h5')
 
-        tiv = dataset_df['EstimatedTotalIntraCranialVol'].values
-        tiv = tiv[:, np.newaxis]
+    # Save scaler
+    joblib.dump(scaler, bootstrap_model_dir / 'scaler.joblib')
 
-        x_data = (np.true_divide(x_data, tiv)).astype('float32')
+    joblib.dump(enc_age, bootstrap_model_dir / 'age_encoder.joblib')
+    joblib.dump(enc_gender, bootstrap_model_dir / 'gender_encoder.joblib')
 
-        scaler = RobustScaler()
-        x_data_normalized = scaler.fit_transform(x_data)
 
-        # ----------------------------------------------------------------------------
-        age = dataset_df['Age'].values[:, np.newaxis].astype('float32')
-        enc_age = OneHotEncoder(sparse=False)
-        one_hot_age = enc_age.fit_transform(age)
+def get_trainer(n_features, n_labels, fused=False):
+    """Get the trainer of the current process for data of the given shape, creating it on first use."""
+    if (n_features, n_labels, fused) not in TRAINERS:
+        TRAINERS[(n_features, n_labels, fused)] = AAETrainer(n_features, n_labels, h_dim=[100, 100], z_dim=20,
+                                                             base_lr=0.0001, max_lr=0.005, gamma=0.98, fused=fused)
 
-        gender = dataset_df['Gender'].values[:, np.newaxis].astype('float32')
-        enc_gender = OneHotEncoder(sparse=False)
-        one_hot_gender = enc_gender.fit_transform(gender)
+    return TRAINERS[(n_features, n_labels, fused)]
 
-        y_data = np.concatenate((one_hot_age, one_hot_gender), axis=1).astype('float32')
 
-        # -------------------------------------------------------------------------------------------------------------
-        # Create the dataset iterator
-        batch_size = 256
-        n_samples = x_data.shape[0]
+def load_base_weights(base_model_dir):
+    """Load the weights of the base model and the categories of its demographic data encoders."""
+    base_weights = {}
+    for model_name in ['encoder', 'decoder', 'discriminator']:
+        model = keras.models.load_model(base_model_dir / (model_name + '.h5'), compile=False)
+        base_weights[model_name] = model.get_weights()
 
-        train_dataset = tf.data.Dataset.from_tensor_slices((x_data_normalized, y_data))
-        train_dataset = train_dataset.shuffle(buffer_size=n_samples)
-        train_dataset = train_dataset.batch(batch_size)
+    base_weights['age_categories'] = joblib.load(base_model_dir / 'age_encoder.joblib').categories_[0]
+    base_weights['gender_categories'] = joblib.load(base_model_dir / 'gender_encoder.joblib').categories_[0]
 
-        # -------------------------------------------------------------------------------------------------------------
-        # Create models
-        n_features = x_data_normalized.shape[1]
-        n_labels = y_data.shape[1]
-        h_dim = [100, 100]
-        z_dim = 20
+    return base_weights
 
-        encoder = make_encoder_model_v1(n_features, h_dim, z_dim)
-        decoder = make_decoder_model_v1(z_dim + n_labels, n_features, h_dim)
-        discriminator = make_discriminator_model_v1(z_dim, h_dim)
 
-        # -------------------------------------------------------------------------------------------------------------
-        # Define loss functions
-        cross_entropy = tf.keras.losses.BinaryCrossentropy(from_logits=True)
-        mse = tf.keras.losses.MeanSquaredError()
-        accuracy = tf.keras.metrics.BinaryAccuracy()
+def set_base_weights(trainer, base_weights, enc_age, enc_gender):
+    """Initialise the models of the trainer with the weights of the base model.
 
-        def discriminator_loss(real_output, fake_output):
-            loss_real = cross_entropy(tf.ones_like(real_output), real_output)
-            loss_fake = cross_entropy(tf.zeros_like(fake_output), fake_output)
-            return loss_fake + loss_real
+    A bootstrapped sample may miss some of the ages of the full cohort, so its decoder has fewer one-hot inputs. The
+    rows of the first kernel of the decoder are selected by category.
+    """
+    z_dim = trainer.z_dim
+    n_base_ages = len(base_weights['age_categories'])
 
-        def generator_loss(fake_output):
-            return cross_entropy(tf.ones_like(fake_output), fake_output)
+    age_rows = np.searchsorted(base_weights['age_categories'], enc_age.categories_[0])
+    age_rows = np.minimum(age_rows, n_base_ages - 1)
+    gender_rows = np.searchsorted(base_weights['gender_categories'], enc_gender.categories_[0])
+    gender_rows = np.minimum(gender_rows, len(base_weights['gender_categories']) - 1)
+    if not (np.array_equal(base_weights['age_categories'][age_rows], enc_age.categories_[0]) and
+            np.array_equal(base_weights['gender_categories'][gender_rows], enc_gender.categories_[0])):
+        raise ValueError('The demographic data of the replica are not in the data of the base model.')
 
-        # -------------------------------------------------------------------------------------------------------------
-        # Define optimizers
-        base_lr = 0.0001
-        max_lr = 0.005
+    rows = np.concatenate([np.arange(z_dim), z_dim + age_rows, z_dim + n_base_ages + gender_rows])
 
-        step_size = 2 * np.ceil(n_samples / batch_size)
+    decoder_weights = list(base_weights['decoder'])
+    decoder_weights[0] = decoder_weights[0][rows]
 
-        ae_optimizer = tf.keras.optimizers.Adam(lr=base_lr)
-        dc_optimizer = tf.keras.optimizers.Adam(lr=base_lr)
-        gen_optimizer = tf.keras.optimizers.Adam(lr=base_lr)
+    trainer.encoder.set_weights(base_weights['encoder'])
+    trainer.decoder.set_weights(decoder_weights)
+    trainer.discriminator.set_weights(base_weights['discriminator'])
+
+
+def train_base_model(participants_path, freesurfer_path, ids_path, base_model_dir,
+                     random_seed=42, verbose=True, fused=False, n_epochs=200):
+    """Train the normative model on the full cleaned cohort to warm-start the bootstrap replicas."""
+    base_model_dir.mkdir(exist_ok=True)
+
+    np.random.seed(random_seed)
+    rn.seed(random_seed)
+
+    x_data_normalized, y_data, sample_weight, scaler, enc_age, enc_gender = load_bootstrap_data(participants_path,
+                                                                                                ids_path,
+                                                                                                freesurfer_path)
+
+    batch_size = 256
+    step_size = 2 * np.ceil(x_data_normalized.shape[0] / batch_size)
+
+    trainer = get_trainer(x_data_normalized.shape[1], y_data.shape[1], fused)
+    trainer.reset(random_seed)
+    training_time = trainer.fit(x_data_normalized, y_data, sample_weight, batch_size, n_epochs, step_size,
+                                verbose=verbose)
+    print('BASE MODEL TRAINING TIME: {:.2f}'.format(training_time))
+
+    encoder, decoder, discriminator = trainer.export_models()
+    save_bootstrap_replica(base_model_dir, encoder, decoder, discriminator, scaler, enc_age, enc_gender)
 
-        # -------------------------------------------------------------------------------------------------------------
-        # Training function
-        @tf.function
-        def train_step(batch_x, batch_y):
-            # -------------------------------------------------------------------------------------------------------------
-            # Autoencoder
-            with tf.GradientTape() as ae_tape:
-                encoder_output = encoder(batch_x, training=True)
-                decoder_output = decoder(tf.concat([encoder_output, batch_y], axis=1), training=True)
 
-                # Autoencoder loss
-                ae_loss = mse(batch_x, decoder_output)
+def update_manifest(manifest_path, records):
+    """Append the records of the replicas that were trained and saved to the manifest."""
+    pd.DataFrame(records).to_csv(manifest_path, mode='a', header=not manifest_path.exists(), index=False)
 
-            ae_grads = ae_tape.gradient(ae_loss, encoder.trainable_variables + decoder.trainable_variables)
-            ae_optimizer.apply_gradients(zip(ae_grads, encoder.trainable_variables + decoder.trainable_variables))
 
-            # -------------------------------------------------------------------------------------------------------------
-            # Discriminator
-            with tf.GradientTape() as dc_tape:
-                real_distribution = tf.random.normal([batch_x.shape[0], z_dim], mean=0.0, stddev=1.0)
-                encoder_output = encoder(batch_x, training=True)
+def train_bootstrap_replica(i_bootstrap, participants_path, freesurfer_path, ids_dir, model_dir,
+                            random_seed=42, verbose=True, weighted=False, fused=False, resume=False,
+                            checkpoint_every=10, early_stopping=None, base_weights=None, n_epochs=200):
+    """Train the normative model on one bootstrapped sample and save it with its scaler and encoders.
 
-                dc_real = discriminator(real_distribution, training=True)
-                dc_fake = discriminator(encoder_output, training=True)
+    Returns
+    -------
+    A list with the record of the replica: its index, the number of epochs run and the time (in seconds) spent tracing
+    and compiling the training graph and training the models.
+    """
+    ids_filename = 'cleaned_bootstrap_{:03d}.csv'.format(i_bootstrap)
+    ids_path = ids_dir / ids_filename
+
+    bootstrap_model_dir = model_dir / '{:03d}'.format(i_bootstrap)
+    bootstrap_model_dir.mkdir(exist_ok=True)
+
+    checkpoint_dir = bootstrap_model_dir / 'checkpoints'
+    if not resume:
+        shutil.rmtree(checkpoint_dir, ignore_errors=True)
+
+    # ----------------------------------------------------------------------------
+    # Set random seed
+    seed = random_seed + i_bootstrap
+    np.random.seed(seed)
+    rn.seed(seed)
+
+    # ----------------------------------------------------------------------------
+    # Loading data
+    x_data_normalized, y_data, sample_weight, scaler, enc_age, enc_gender = load_bootstrap_data(participants_path,
+                                                                                                ids_path,
+                                                                                                freesurfer_path,
+                                                                                                weighted)
+
+    # -------------------------------------------------------------------------------------------------------------
+    # Define the batches (the data are shuffled in the graph at each epoch)
+    batch_size = 256
+    n_samples = int(np.sum(sample_weight))
+    n_rows = x_data_normalized.shape[0]
+    rows_batch_size = int(np.ceil(batch_size * n_rows / n_samples))
+
+    # -------------------------------------------------------------------------------------------------------------
+    # Get the models and reset them for this replica
+    n_features = x_data_normalized.shape[1]
+    n_labels = y_data.shape[1]
+
+    new_trainer = (n_features, n_labels, fused) not in TRAINERS
+    trainer = get_trainer(n_features, n_labels, fused)
+    trainer.reset(seed)
+    if base_weights is not None:
+        set_base_weights(trainer, base_weights, enc_age, enc_gender)
+
+    # -------------------------------------------------------------------------------------------------------------
+    # Training loop
+    step_size = 2 * np.ceil(n_samples / batch_size)
+
+    monitor = ConvergenceMonitor(**early_stopping) if early_stopping is not None else None
+
+    training_time = trainer.fit(x_data_normalized, y_data, sample_weight, rows_batch_size, n_epochs, step_size,
+                                verbose=verbose,
+                                checkpoint_dir=checkpoint_dir if checkpoint_every > 0 else None,
+                                checkpoint_every=checkpoint_every,
+                                monitor=monitor)
+
+    record = {'i_bootstrap': i_bootstrap, 'n_epochs': int(trainer.epoch),
+              'tracing_time': 0., 'compiling_time': 0., 'training_time': training_time}
+    if new_trainer:
+        record['tracing_time'] = trainer.trace_time
+        record['compiling_time'] = trainer.compile_time
+
+    if verbose:
+        print('TRACING TIME: {:.2f} COMPILING TIME: {:.2f} TRAINING TIME: {:.2f}' \
+              .format(record['tracing_time'], record['compiling_time'], record['training_time']))
+
+    # Save models
+    encoder, decoder, discriminator = trainer.export_models()
+    save_bootstrap_replica(bootstrap_model_dir, encoder, decoder, discriminator, scaler, enc_age, enc_gender)
+
+    shutil.rmtree(checkpoint_dir, ignore_errors=True)
+
+    return [record]
+
+
+def train_bootstrap_ensemble(i_bootstraps, participants_path, freesurfer_path, ids_dir, model_dir,
+                             random_seed=42, verbose=True):
+    """Train several bootstrap replicas at once as an ensemble with stacked weights (see ensemble.py).
+
+    The chunk is not checkpointed: if it is interrupted, all its replicas are trained again.
+
+    Returns
+    -------
+    A list with the record of each replica: its index and its share of the time (in seconds) spent training the
+    ensemble (including its tracing).
+    """
+    records = []
+
+    # ----------------------------------------------------------------------------
+    # Loading data
+    bootstrap_data = {}
+    for i_bootstrap in i_bootstraps:
+        ids_path = ids_dir / 'cleaned_bootstrap_{:03d}.csv'.format(i_bootstrap)
+        bootstrap_data[i_bootstrap] = load_bootstrap_data(participants_path, ids_path, freesurfer_path)
 
-                # Discriminator Loss
-                dc_loss = discriminator_loss(dc_real, dc_fake)
+    # Only replicas with data of the same shape can be stacked (the number of one-hot encoded ages depends on the
+    # ages present in the bootstrapped sample)
+    for _, group in groupby(i_bootstraps, key=lambda i: (bootstrap_data[i][0].shape, bootstrap_data[i][1].shape)):
+        group = list(group)
+        start_time = time.time()
 
-                # Discriminator Acc
-                dc_acc = accuracy(tf.concat([tf.ones_like(dc_real), tf.zeros_like(dc_fake)], axis=0),
-                                  tf.concat([dc_real, dc_fake], axis=0))
+        tf.keras.backend.clear_session()
+        tf.random.set_seed(random_seed + group[0])
+        random_states = [np.random.RandomState(random_seed + i_bootstrap) for i_bootstrap in group]
 
-            dc_grads = dc_tape.gradient(dc_loss, discriminator.trainable_variables)
-            dc_optimizer.apply_gradients(zip(dc_grads, discriminator.trainable_variables))
+        x_data_normalized = np.stack([bootstrap_data[i_bootstrap][0] for i_bootstrap in group])
+        y_data = np.stack([bootstrap_data[i_bootstrap][1] for i_bootstrap in group])
 
-            # -------------------------------------------------------------------------------------------------------------
-            # Generator (Encoder)
-            with tf.GradientTape() as gen_tape:
-                encoder_output = encoder(batch_x, training=True)
-                dc_fake = discriminator(encoder_output, training=True)
+        # -------------------------------------------------------------------------------------------------------------
+        # Create ensemble
+        batch_size = 256
+        n_members, n_samples, n_features = x_data_normalized.shape
+        n_labels = y_data.shape[2]
+        h_dim = [100, 100]
+        z_dim = 20
 
-                # Generator loss
-                gen_loss = generator_loss(dc_fake)
+        base_lr = 0.0001
+        max_lr = 0.005
 
-            gen_grads = gen_tape.gradient(gen_loss, encoder.trainable_variables)
-            gen_optimizer.apply_gradients(zip(gen_grads, encoder.trainable_variables))
+        step_size = 2 * np.ceil(n_samples / batch_size)
+
+        lr_schedule = CyclicalLearningRate(base_lr, max_lr, step_size, gamma=0.98)
+        ensemble = EnsembleAAE(random_states, n_features, n_labels, h_dim, z_dim, lr_schedule)
 
-            return ae_loss, dc_loss, dc_acc, gen_loss
+        x_data_normalized = tf.constant(x_data_normalized)
+        y_data = tf.constant(y_data)
+        batch_size = tf.constant(batch_size, dtype=tf.int32)
 
         # -------------------------------------------------------------------------------------------------------------
         # Training loop
-        global_step = 0
         n_epochs = 200
-        gamma = 0.98
-        scale_fn = lambda x: gamma ** x
         for epoch in range(n_epochs):
             start = time.time()
 
-            epoch_ae_loss_avg = tf.metrics.Mean()
-            epoch_dc_loss_avg = tf.metrics.Mean()
-            epoch_dc_acc_avg = tf.metrics.Mean()
-            epoch_gen_loss_avg = tf.metrics.Mean()
+            for metric in [ensemble.epoch_ae_loss_avg, ensemble.epoch_dc_loss_avg,
+                           ensemble.epoch_dc_acc_avg, ensemble.epoch_gen_loss_avg]:
+                metric.reset_states()
 
-            for _, (batch_x, batch_y) in enumerate(train_dataset):
-                global_step = global_step + 1
-                cycle = np.floor(1 + global_step / (2 * step_size))
-                x_lr = np.abs(global_step / step_size - 2 * cycle + 1)
-                clr = base_lr + (max_lr - base_lr) * max(0, 1 - x_lr) * scale_fn(cycle)
-                ae_optimizer.lr = clr
-                dc_optimizer.lr = clr
-                gen_optimizer.lr = clr
+            ensemble.train_epoch(x_data_normalized, y_data, batch_size)
 
-                ae_loss, dc_loss, dc_acc, gen_loss = train_step(batch_x, batch_y)
+            epoch_time = time.time() - start
 
-                epoch_ae_loss_avg(ae_loss)
-                epoch_dc_loss_avg(dc_loss)
-                epoch_dc_acc_avg(dc_acc)
-                epoch_gen_loss_avg(gen_loss)
+            if verbose:
+                print('{:4d}: TIME: {:.2f} ETA: {:.2f} AE_LOSS: {:.4f} DC_LOSS: {:.4f} DC_ACC: {:.4f} GEN_LOSS: {:.4f}' \
+                      .format(epoch, epoch_time,
+                              epoch_time * (n_epochs - epoch),
+                              ensemble.epoch_ae_loss_avg.result(),
+                              ensemble.epoch_dc_loss_avg.result(),
+                              ensemble.epoch_dc_acc_avg.result(),
+                              ensemble.epoch_gen_loss_avg.result()))
 
-            epoch_time = time.time() - start
+        # -------------------------------------------------------------------------------------------------------------
+        # Save each member as a single bootstrap replica
+        for i_member, i_bootstrap in enumerate(group):
+            bootstrap_model_dir = model_dir / '{:03d}'.format(i_bootstrap)
+            bootstrap_model_dir.mkdir(exist_ok=True)
 
-            print('{:4d}: TIME: {:.2f} ETA: {:.2f} AE_LOSS: {:.4f} DC_LOSS: {:.4f} DC_ACC: {:.4f} GEN_LOSS: {:.4f}' \
-                  .format(epoch, epoch_time,
-                          epoch_time * (n_epochs - epoch),
-                          epoch_ae_loss_avg.result(),
-                          epoch_dc_loss_avg.result(),
-                          epoch_dc_acc_avg.result(),
-                          epoch_gen_loss_avg.result()))
+            # Clean session to get the same layer names as train_bootstrap_replica
+            tf.keras.backend.clear_session()
+            encoder, decoder, discriminator = ensemble.get_member_models(i_member)
 
-        # Save models
-        encoder.save(bootstrap_model_dir / 'encoder.h5')
-        decoder.save(bootstrap_model_dir / 'decoder.h5')
-        discriminator.save(bootstrap_model_dir / 'discriminator.h5')
+            _, _, _, scaler, enc_age, enc_gender = bootstrap_data[i_bootstrap]
+            save_bootstrap_replica(bootstrap_model_dir, encoder, decoder, discriminator, scaler, enc_age, enc_gender)
 
-        # Save scaler
-        joblib.dump(scaler, bootstrap_model_dir / 'scaler.joblib')
+        training_time = (time.time() - start_time) / len(group)
+        records.extend({'i_bootstrap': i_bootstrap, 'n_epochs': n_epochs, 'tracing_time': 0., 'compiling_time': 0.,
+                        'training_time': training_time} for i_bootstrap in group)
 
-        joblib.dump(enc_age, bootstrap_model_dir / 'age_encoder.joblib')
-        joblib.dump(enc_gender, bootstrap_model_dir / 'gender_encoder.joblib')
+    return records
+
+
+def main(n_workers=1, intra_op_threads=None, inter_op_threads=None, ensemble_size=1, weighted=False, fused=False,
+         resume=False, checkpoint_every=10, early_stopping=None, model_name=None, warm_start=False,
+         fine_tune_epochs=50):
+    """Train the normative method on the bootstrapped samples.
+
+    The script also the scaler and the demographic data encoder.
+    """
+    # ----------------------------------------------------------------------------
+    n_bootstrap = 1000
+    if model_name is None:
+        model_name = 'supervised_aae_warm_start' if warm_start else 'supervised_aae'
+
+    participants_path = PROJECT_ROOT / 'data' / 'BIOBANK' / 'participants.tsv'
+    freesurfer_path = PROJECT_ROOT / 'data' / 'BIOBANK' / 'freesurferData.csv'
+    # ----------------------------------------------------------------------------
+    bootstrap_dir = PROJECT_ROOT / 'outputs' / 'bootstrap_analysis'
+    ids_dir = bootstrap_dir / 'ids'
+
+    model_dir = bootstrap_dir / model_name
+    model_dir.mkdir(exist_ok=True)
+
+    # ----------------------------------------------------------------------------
+    random_seed = 42
+
+    manifest_path = model_dir / 'manifest.csv'
+    if resume and manifest_path.exists():
+        completed = set(pd.read_csv(manifest_path)['i_bootstrap'])
+    else:
+        completed = set()
+        if manifest_path.exists():
+            manifest_path.unlink()
+
+    i_bootstraps = [i_bootstrap for i_bootstrap in range(n_bootstrap) if i_bootstrap not in completed]
+    print('{} of {} replicas left to train'.format(len(i_bootstraps), n_bootstrap))
+
+    if n_workers == 1:
+        set_thread_budget(intra_op_threads, inter_op_threads)
+
+    if ensemble_size > 1:
+        if weighted or fused or early_stopping is not None or warm_start:
+            raise ValueError('The weighted bootstrap, the fused step, the early stopping and the warm start are not '
+                             'available for the ensemble training.')
+
+        # Each unit of work is a chunk of replicas trained together
+        train_fn = train_bootstrap_ensemble
+        work_units = [i_bootstraps[i_start:i_start + ensemble_size]
+                      for i_start in range(0, len(i_bootstraps), ensemble_size)]
+    else:
+        base_weights = None
+        n_epochs = 200
+        if warm_start:
+            base_model_dir = model_dir / 'base'
+            if not (resume and (base_model_dir / 'encoder.h5').exists()):
+                train_base_model(participants_path, freesurfer_path, PROJECT_ROOT / 'outputs' / 'cleaned_ids.csv',
+                                 base_model_dir, random_seed=random_seed, fused=fused)
+
+            base_weights = load_base_weights(base_model_dir)
+            n_epochs = fine_tune_epochs
+
+        train_fn = partial(train_bootstrap_replica, weighted=weighted, fused=fused, resume=resume,
+                           checkpoint_every=checkpoint_every, early_stopping=early_stopping,
+                           base_weights=base_weights, n_epochs=n_epochs)
+        work_units = i_bootstraps
+
+    if n_workers == 1:
+        for work_unit in work_units:
+            records = train_fn(work_unit, participants_path, freesurfer_path, ids_dir, model_dir,
+                               random_seed=random_seed)
+            update_manifest(manifest_path, records)
+
+    else:
+        if intra_op_threads is None:
+            intra_op_threads = max(1, multiprocessing.cpu_count() // n_workers)
+        if inter_op_threads is None:
+            inter_op_threads = 1
+
+        train_fn = partial(train_fn,
+                           participants_path=participants_path,
+                           freesurfer_path=freesurfer_path,
+                           ids_dir=ids_dir,
+                           model_dir=model_dir,
+                           random_seed=random_seed,
+                           verbose=False)
+
+        # TensorFlow is not fork-safe, so the workers are started from a fresh interpreter
+        context = multiprocessing.get_context('spawn')
+        with context.Pool(n_workers,
+                          initializer=set_thread_budget,
+                          initargs=(intra_op_threads, inter_op_threads)) as pool:
+            # Only the main process writes the manifest
+            for records in tqdm(pool.imap_unordered(train_fn, work_units), total=len(work_units)):
+                update_manifest(manifest_path, records)
+
+    if not manifest_path.exists():
+        return
+
+    manifest_df = pd.read_csv(manifest_path)
+    print('TOTAL EPOCHS: {:d} TOTAL TRACING TIME: {:.2f} TOTAL COMPILING TIME: {:.2f} TOTAL TRAINING TIME: {:.2f}' \
+          .format(manifest_df['n_epochs'].sum(),
+                  manifest_df['tracing_time'].sum(),
+                  manifest_df['compiling_time'].sum(),
+                  manifest_df['training_time'].sum()))
 
 
 if __name__ == "__main__":
-    main()
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-W', '--n_workers',
+                        dest='n_workers',
+                        help='Number of worker processes used to train the bootstrap replicas. Each worker gets '
+                             'its own TensorFlow thread budget (by default, the cores split between the workers).',
+                        type=int, default=1)
+    parser.add_argument('--intra_op_threads',
+                        dest='intra_op_threads',
+                        help='Number of TensorFlow intra-op threads per process.',
+                        type=int)
+    parser.add_argument('--inter_op_threads',
+                        dest='inter_op_threads',
+                        help='Number of TensorFlow inter-op threads per process.',
+                        type=int)
+    parser.add_argument('-K', '--ensemble_size',
+                        dest='ensemble_size',
+                        help='Number of bootstrap replicas trained together in a single graph with stacked weights.',
+                        type=int, default=1)
+    parser.add_argument('--weighted_bootstrap',
+                        dest='weighted',
+                        help='Train on the unique subjects weighted by their bootstrap counts, with the batch size '
+                             'reduced in the same proportion as the number of rows.',
+                        action='store_true')
+    parser.add_argument('--fused_step',
+                        dest='fused',
+                        help='Use the training step that shares the encoder forward pass between the discriminator '
+                             'and the generator phases.',
+                        action='store_true')
+    parser.add_argument('--resume',
+                        dest='resume',
+                        help='Skip the replicas of the manifest and continue the interrupted ones from their last '
+                             'checkpoint (otherwise the manifest is cleared and all the replicas are trained).',
+                        action='store_true')
+    parser.add_argument('--checkpoint_every',
+                        dest='checkpoint_every',
+                        help='Number of epochs between the checkpoints of a replica (0 to disable them). The '
+                             'checkpoints are deleted once the replica is saved.',
+                        type=int, default=10)
+    parser.add_argument('--early_stopping',
+                        dest='early_stopping',
+                        help='Stop the training of each replica once the autoencoder loss and the discriminator '
+                             'accuracy reach a plateau. The number of epochs is recorded in the manifest.',
+                        action='store_true')
+    parser.add_argument('--patience',
+                        dest='patience',
+                        help='Number of epochs without improvement before stopping.',
+                        type=int, default=20)
+    parser.add_argument('--min_delta',
+                        dest='min_delta',
+                        help='Minimum decrease of the autoencoder loss counted as an improvement.',
+                        type=float, default=0.001)
+    parser.add_argument('--min_epochs',
+                        dest='min_epochs',
+                        help='Minimum number of epochs of each replica.',
+                        type=int, default=50)
+    parser.add_argument('--dc_acc_delta',
+                        dest='dc_acc_delta',
+                        help='Minimum change of the discriminator accuracy counted as a change.',
+                        type=float, default=0.02)
+
+    parser.add_argument('-M', '--model_name',
+                        dest='model_name',
+                        help='Name of the directory of the trained models (supervised_aae or, with the warm start, '
+                             'supervised_aae_warm_start by default).')
+    parser.add_argument('--warm_start',
+                        dest='warm_start',
+                        help='Fine-tune the replicas from a base model trained on the full cleaned cohort (saved in '
+                             'the base directory of the model directory).',
+                        action='store_true')
+    parser.add_argument('--fine_tune_epochs',
+                        dest='fine_tune_epochs',
+                        help='Number of epochs of each replica with the warm start.',
+                        type=int, default=50)
+    args = parser.parse_args()
+
+    if args.ensemble_size > 1:
+        for option, used in [('--weighted_bootstrap', args.weighted), ('--fused_step', args.fused),
+                             ('--early_stopping', args.early_stopping), ('--warm_start', args.warm_start)]:
+            if used:
+                parser.error('{} is not available with the ensemble training (-K/--ensemble_size > 1)'.format(option))
+
+    early_stopping = None
+    if args.early_stopping:
+        early_stopping = {'patience': args.patience,
+                          'min_delta': args.min_delta,
+                          'min_epochs': args.min_epochs,
+                          'dc_acc_delta': args.dc_acc_delta}
+
+    main(args.n_workers, args.intra_op_threads, args.inter_op_threads, args.ensemble_size, args.weighted, args.fused,
+         args.resume, args.checkpoint_every, early_stopping, args.model_name, args.warm_start, args.fine_tune_epochs)
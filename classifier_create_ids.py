@@ -48,8 +48,10 @@ def main(dataset_name, disease_label):
 
     n_sub = len(dataset_df)
 
+    train_indices = np.zeros((n_bootstrap, n_sub), dtype=int)
     for i_bootstrap in tqdm(range(n_bootstrap)):
         bootstrap_ids = dataset_df.sample(n=n_sub, replace=True, random_state=i_bootstrap)
+        train_indices[i_bootstrap] = bootstrap_ids.index.values
 
         ids_filename = 'homogeneous_bootstrap_{:03d}_train.csv'.format(i_bootstrap)
         bootstrap_ids.to_csv(ids_dir / ids_filename, index=False)
@@ -59,6 +61,11 @@ def main(dataset_name, disease_label):
         ids_filename = 'homogeneous_bootstrap_{:03d}_test.csv'.format(i_bootstrap)
         bootstrap_ids_test.to_csv(ids_dir / ids_filename, index=False)
 
+    # Same samples as indices of the subjects, used by classifier_train.py instead of the ids files
+    np.savez(ids_dir / 'homogeneous_bootstrap_indices.npz',
+             image_ids=np.asarray(dataset_df['Image_ID'], dtype=str),
+             train_indices=train_indices)
+
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser()
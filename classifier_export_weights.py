@@ -0,0 +1,91 @@
+#!/usr/bin/env python3
+"""Script to export the bootstrap classifiers of a contrast as a matrix of linear coefficients.
+
+With a linear kernel, the decision function of a relevance vector classifier is a linear function of the scaled
+brain regions, so the scaler can be folded in and each classifier reduces to a weight vector and a bias in the space
+of the brain regions (divided by the total intracranial volume). The whole ensemble is then evaluated with a single
+matrix product (see classifier_test.py).
+"""
+import argparse
+from pathlib import Path
+
+import numpy as np
+from joblib import load
+from tqdm import tqdm
+
+PROJECT_ROOT = Path.cwd()
+
+
+def linear_classifier_weights(rvm, scaler):
+    """Get the coefficients and the intercept of a linear EMRVC with its RobustScaler folded in.
+
+    The probabilities of rvm.predict_proba(scaler.transform(x))[:, 1] are expit(x @ coefficients + intercept).
+    """
+    mu = rvm.mu_
+    bias = 0.0
+    if rvm.bias_used:
+        bias, mu = mu[0], mu[1:]
+
+    # The kernel of EMRVC is divided by a scale computed on the training data
+    weights = np.dot(mu, rvm.relevance_vectors_) / rvm._scale
+
+    coefficients = weights / scaler.scale_
+    intercept = bias - np.dot(scaler.center_, coefficients)
+
+    return coefficients, intercept
+
+
+def load_linear_ensemble(ensemble_path):
+    """Load the coefficients, with shape [n_bootstrap, n_features], and the intercepts of an exported ensemble."""
+    with np.load(ensemble_path) as archive:
+        return archive['coefficients'], archive['intercepts']
+
+
+def export_linear_ensemble(classifier_storage_dir, n_bootstrap):
+    """Get the coefficients, with shape [n_bootstrap, n_features], and the intercepts of the saved classifiers."""
+    coefficients = []
+    intercepts = []
+    for i_bootstrap in tqdm(range(n_bootstrap)):
+        rvm = load(classifier_storage_dir / '{:03d}_rvr.joblib'.format(i_bootstrap))
+        scaler = load(classifier_storage_dir / '{:03d}_scaler.joblib'.format(i_bootstrap))
+
+        if rvm.kernel != 'linear':
+            raise ValueError('Only the classifiers with a linear kernel can be exported.')
+
+        classifier_coefficients, classifier_intercept = linear_classifier_weights(rvm, scaler)
+        coefficients.append(classifier_coefficients)
+        intercepts.append(classifier_intercept)
+
+    return np.array(coefficients), np.array(intercepts)
+
+
+def main(dataset_name, disease_label):
+    """Export the classifiers of the bootstrap iterations in the linear_ensemble.npz file of the contrast."""
+    # ----------------------------------------------------------------------------
+    n_bootstrap = 1000
+
+    hc_label = 1
+
+    classifier_dir = PROJECT_ROOT / 'outputs' / 'classifier_analysis'
+    classifier_dataset_dir = classifier_dir / dataset_name
+    classifier_dataset_analysis_dir = classifier_dataset_dir / '{:02d}_vs_{:02d}'.format(hc_label, disease_label)
+    classifier_storage_dir = classifier_dataset_analysis_dir / 'models'
+
+    # ----------------------------------------------------------------------------
+    coefficients, intercepts = export_linear_ensemble(classifier_storage_dir, n_bootstrap)
+
+    np.savez(classifier_dataset_analysis_dir / 'linear_ensemble.npz', coefficients=coefficients, intercepts=intercepts)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-D', '--dataset_name',
+                        dest='dataset_name',
+                        help='Dataset name of the classifiers.')
+    parser.add_argument('-L', '--disease_label',
+                        dest='disease_label',
+                        help='Disease label of the classifiers.',
+                        type=int)
+    args = parser.parse_args()
+
+    main(args.dataset_name, args.disease_label)
@@ -0,0 +1,96 @@
+#!/usr/bin/env python3
+"""Script to compute the generalization of the classifiers and of the normative model to all the other datasets.
+
+It replaces the runs of classifier_test.py and classifier_vs_normative_generalization.py for each (training dataset,
+evaluated dataset, disease label) triple: each dataset and each classifier ensemble are loaded once, the per-pair
+files of both scripts are written from the same arrays, and the AUC-ROCs of all the pairs are summarised in
+outputs/classifier_analysis/generalization_matrix.csv.
+"""
+import argparse
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+from classifier_test import compute_ensemble_aucs, load_classifier_ensemble, load_evaluation_data, save_aucs
+from classifier_vs_normative_generalization import load_normative_aucs, save_comparison
+
+PROJECT_ROOT = Path.cwd()
+
+
+def main(dataset_names, disease_labels):
+    """Evaluate the classifiers of each dataset on every other dataset where the normative model was evaluated."""
+    # ----------------------------------------------------------------------------
+    n_bootstrap = 1000
+
+    hc_label = 1
+
+    bootstrap_dir = PROJECT_ROOT / 'outputs' / 'bootstrap_analysis'
+    classifier_dir = PROJECT_ROOT / 'outputs' / 'classifier_analysis'
+
+    evaluation_data = {dataset_name: load_evaluation_data(dataset_name) for dataset_name in dataset_names}
+
+    # ----------------------------------------------------------------------------
+    matrix = []
+    for disease_label in disease_labels:
+        # The evaluated datasets of a disease are the ones where the normative model was evaluated on this disease
+        contrast = '{:02d}_vs_{:02d}'.format(hc_label, disease_label)
+        evaluated_datasets = [dataset_name for dataset_name in dataset_names
+                              if (bootstrap_dir / dataset_name / contrast / 'auc_rocs.csv').exists()]
+
+        normative_aucs = {}
+        for evaluated_dataset in evaluated_datasets:
+            normative_aucs[evaluated_dataset] = load_normative_aucs(evaluated_dataset, disease_label, hc_label)
+            matrix.append(['Normative', evaluated_dataset, disease_label, normative_aucs[evaluated_dataset],
+                           [np.nan, np.nan]])
+
+        for dataset_name in dataset_names:
+            classifier_dataset_analysis_dir = classifier_dir / dataset_name / contrast
+            if not ((classifier_dataset_analysis_dir / 'models').exists() or
+                    (classifier_dataset_analysis_dir / 'linear_ensemble.npz').exists()):
+                continue
+
+            print('{} {}'.format(dataset_name, contrast))
+            generalization_dir = classifier_dataset_analysis_dir / 'generalization'
+            generalization_dir.mkdir(exist_ok=True)
+
+            coefficients, intercepts = load_classifier_ensemble(classifier_dataset_analysis_dir, n_bootstrap)
+
+            for evaluated_dataset in evaluated_datasets:
+                if evaluated_dataset == dataset_name:
+                    continue
+
+                x_data, diagnosis = evaluation_data[evaluated_dataset]
+                aucs_test = compute_ensemble_aucs(coefficients, intercepts, x_data, diagnosis, hc_label,
+                                                  disease_label)
+                save_aucs(generalization_dir, evaluated_dataset, aucs_test)
+
+                comparison = save_comparison(generalization_dir, evaluated_dataset, disease_label,
+                                             normative_aucs[evaluated_dataset], aucs_test)
+                matrix.append([dataset_name, evaluated_dataset, disease_label, aucs_test, comparison['Value'].values])
+
+    # ----------------------------------------------------------------------------
+    matrix_df = pd.DataFrame({'Training dataset': [row[0] for row in matrix],
+                              'Evaluated dataset': [row[1] for row in matrix],
+                              'Disease label': [row[2] for row in matrix],
+                              'Mean AUC': [np.mean(row[3]) for row in matrix],
+                              'Lower AUC': [np.percentile(row[3], 2.5) for row in matrix],
+                              'Upper AUC': [np.percentile(row[3], 97.5) for row in matrix],
+                              'Lower normative - classifier': [row[4][0] for row in matrix],
+                              'Upper normative - classifier': [row[4][1] for row in matrix]})
+    matrix_df.to_csv(classifier_dir / 'generalization_matrix.csv', index=False)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-D', '--dataset_names',
+                        dest='dataset_names',
+                        help='Names of the datasets used to train and to evaluate the classifiers.',
+                        nargs='+', default=['ADNI', 'TOMC', 'OASIS1', 'AIBL', 'MIRIAD'])
+    parser.add_argument('-L', '--disease_labels',
+                        dest='disease_labels',
+                        help='Disease labels of the classifiers.',
+                        type=int, nargs='+', default=[17, 18])
+    args = parser.parse_args()
+
+    main(args.dataset_names, args.disease_labels)
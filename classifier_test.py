@@ -1,31 +1,76 @@
 #!/usr/bin/env python3
-"""Script to get the classification performance."""
+"""Script to get the classification performance.
+
+The classifiers are evaluated as a single linear model per bootstrap iteration (see classifier_export_weights.py), so
+the scores of all the iterations are one matrix product. The linear_ensemble.npz file of the contrast is used when it
+exists, otherwise the coefficients are computed from the saved models.
+"""
 import argparse
 from pathlib import Path
 import random as rn
 
 import numpy as np
 import pandas as pd
-from sklearn.metrics import roc_auc_score
-from tqdm import tqdm
-from joblib import load
 
-from utils import COLUMNS_NAME, load_dataset
+from classifier_export_weights import export_linear_ensemble, load_linear_ensemble
+from utils import COLUMNS_NAME, load_dataset, roc_auc
 
 PROJECT_ROOT = Path.cwd()
 
 
+def load_evaluation_data(evaluated_dataset):
+    """Load the brain regions (divided by the total intracranial volume) and the diagnoses of an evaluated dataset."""
+    participants_path = PROJECT_ROOT / 'data' / evaluated_dataset / 'participants.tsv'
+    freesurfer_path = PROJECT_ROOT / 'data' / evaluated_dataset / 'freesurferData.csv'
+    ids_path = PROJECT_ROOT / 'outputs' / (evaluated_dataset + '_homogeneous_ids.csv')
+
+    evaluated_dataset_df = load_dataset(participants_path, ids_path, freesurfer_path)
+
+    x_data = evaluated_dataset_df[COLUMNS_NAME].values
+
+    tiv = evaluated_dataset_df['EstimatedTotalIntraCranialVol'].values
+    tiv = tiv[:, np.newaxis]
+
+    x_data = (np.true_divide(x_data, tiv)).astype('float32')
+
+    return x_data, evaluated_dataset_df['Diagn'].values
+
+
+def load_classifier_ensemble(classifier_dataset_analysis_dir, n_bootstrap):
+    """Load the linear_ensemble.npz file of a contrast, or compute the coefficients from the saved models."""
+    ensemble_path = classifier_dataset_analysis_dir / 'linear_ensemble.npz'
+    if ensemble_path.exists():
+        return load_linear_ensemble(ensemble_path)
+
+    return export_linear_ensemble(classifier_dataset_analysis_dir / 'models', n_bootstrap)
+
+
+def compute_ensemble_aucs(coefficients, intercepts, x_data, diagnosis, hc_label, disease_label):
+    """Calculate the AUC-ROC of each classifier of the ensemble."""
+    # Decision values of all the iterations, with shape [n_bootstrap, n_subjects]. The AUCs only depend on their
+    # ranking, and the sigmoid of the probabilities would saturate to ties for the well separated subjects.
+    decision_values = np.dot(coefficients, x_data.astype('float64').T) + intercepts[:, np.newaxis]
+
+    return roc_auc(decision_values[:, diagnosis == hc_label], decision_values[:, diagnosis == disease_label])
+
+
+def save_aucs(generalization_dir, evaluated_dataset, aucs_test):
+    """Save the AUC-ROCs of the classifiers on an evaluated dataset and their mean and 95% confidence interval."""
+    aucs_df = pd.DataFrame(columns=['AUCs'], data=aucs_test)
+    aucs_df.to_csv(generalization_dir / '{:}_aucs.csv'.format(evaluated_dataset), index=False)
+
+    results = pd.DataFrame({'Measure': ['mean', 'upper_limit', 'lower_limit'],
+                            'Value': [np.mean(aucs_test),
+                                      np.percentile(aucs_test, 97.5),
+                                      np.percentile(aucs_test, 2.5)]})
+    results.to_csv(generalization_dir / '{:}_aucs_summary.csv'.format(evaluated_dataset), index=False)
+
+
 def main(dataset_name, disease_label, evaluated_dataset):
     """Calculate the performance of the classifier in each iteration of the bootstrap method."""
     # ----------------------------------------------------------------------------
     n_bootstrap = 1000
 
-    participants_path = PROJECT_ROOT / 'data' / evaluated_dataset / 'participants.tsv'
-    freesurfer_path = PROJECT_ROOT / 'data' / evaluated_dataset / 'freesurferData.csv'
-
-    outputs_dir = PROJECT_ROOT / 'outputs'
-    ids_path = outputs_dir / (evaluated_dataset + '_homogeneous_ids.csv')
-
     hc_label = 1
 
     # ----------------------------------------------------------------------------
@@ -38,49 +83,16 @@ def main(dataset_name, disease_label, evaluated_dataset):
     classifier_dataset_dir = classifier_dir / dataset_name
     classifier_dataset_analysis_dir = classifier_dataset_dir / '{:02d}_vs_{:02d}'.format(hc_label, disease_label)
 
-    classifier_storage_dir = classifier_dataset_analysis_dir / 'models'
     generalization_dir = classifier_dataset_analysis_dir / 'generalization'
     generalization_dir.mkdir(exist_ok=True)
 
-    evaluated_dataset_df = load_dataset(participants_path, ids_path, freesurfer_path)
+    x_data, diagnosis = load_evaluation_data(evaluated_dataset)
+    coefficients, intercepts = load_classifier_ensemble(classifier_dataset_analysis_dir, n_bootstrap)
 
-    aucs_test = []
     # ----------------------------------------------------------------------------
-    for i_bootstrap in tqdm(range(n_bootstrap)):
-        rvm = load(classifier_storage_dir / '{:03d}_rvr.joblib'.format(i_bootstrap))
-        scaler = load(classifier_storage_dir / '{:03d}_scaler.joblib'.format(i_bootstrap))
-
-        x_data = evaluated_dataset_df[COLUMNS_NAME].values
-
-        tiv = evaluated_dataset_df['EstimatedTotalIntraCranialVol'].values
-        tiv = tiv[:, np.newaxis]
-
-        x_data = (np.true_divide(x_data, tiv)).astype('float32')
+    aucs_test = compute_ensemble_aucs(coefficients, intercepts, x_data, diagnosis, hc_label, disease_label)
 
-        x_data = np.concatenate((x_data[evaluated_dataset_df['Diagn'] == hc_label],
-                                 x_data[evaluated_dataset_df['Diagn'] == disease_label]), axis=0)
-
-        y_data = np.concatenate((np.zeros(sum(evaluated_dataset_df['Diagn'] == hc_label)),
-                                 np.ones(sum(evaluated_dataset_df['Diagn'] == disease_label))))
-
-        # Scaling using inter-quartile
-        x_data = scaler.transform(x_data)
-
-        pred = rvm.predict(x_data)
-        predictions_proba = rvm.predict_proba(x_data)
-
-        auc = roc_auc_score(y_data, predictions_proba[:, 1])
-
-        aucs_test.append(auc)
-
-    aucs_df = pd.DataFrame(columns=['AUCs'], data=aucs_test)
-    aucs_df.to_csv(generalization_dir / '{:}_aucs.csv'.format(evaluated_dataset), index=False)
-
-    results = pd.DataFrame(columns=['Measure', 'Value'])
-    results = results.append({'Measure': 'mean', 'Value': np.mean(aucs_test)}, ignore_index=True)
-    results = results.append({'Measure': 'upper_limit', 'Value': np.percentile(aucs_test, 97.5)}, ignore_index=True)
-    results = results.append({'Measure': 'lower_limit', 'Value': np.percentile(aucs_test, 2.5)}, ignore_index=True)
-    results.to_csv(generalization_dir / '{:}_aucs_summary.csv'.format(evaluated_dataset), index=False)
+    save_aucs(generalization_dir, evaluated_dataset, aucs_test)
 
 
 if __name__ == "__main__":
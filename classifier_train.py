@@ -1,6 +1,8 @@
 #!/usr/bin/env python3
 """Script to get the classification performance."""
 import argparse
+import multiprocessing
+from functools import partial
 from pathlib import Path
 import random as rn
 
@@ -9,6 +11,7 @@ import pandas as pd
 from sklearn.metrics import roc_auc_score
 from sklearn.preprocessing import RobustScaler
 from sklearn_rvm.em_rvm import EMRVC
+from threadpoolctl import threadpool_limits
 from tqdm import tqdm
 from joblib import dump
 
@@ -17,111 +20,205 @@ from utils import COLUMNS_NAME, load_dataset
 PROJECT_ROOT = Path.cwd()
 
 
-def main(dataset_name, disease_label):
-    """Calculate the performance of the classifier in each iteration of the bootstrap method."""
-    # ----------------------------------------------------------------------------
-    n_bootstrap = 1000
+def set_thread_budget(n_threads):
+    """Limit the number of BLAS and OpenMP threads of the current process (initializer of the pool workers)."""
+    threadpool_limits(limits=n_threads)
 
-    participants_path = PROJECT_ROOT / 'data' / dataset_name / 'participants.tsv'
-    freesurfer_path = PROJECT_ROOT / 'data' / dataset_name / 'freesurferData.csv'
 
-    hc_label = 1
+def load_cohort(participants_path, freesurfer_path, ids_path, hc_label, disease_label):
+    """Load the ids, the brain regions (divided by the total intracranial volume) and the diagnoses of a contrast.
 
-    # ----------------------------------------------------------------------------
-    # Set random seed
-    random_seed = 42
-    np.random.seed(random_seed)
-    rn.seed(random_seed)
+    The subjects are in the order of load_dataset (the order of the freesurferData.csv file), so a bootstrap sample is
+    given by the sorted indices of its subjects.
+    """
+    dataset_df = load_dataset(participants_path, ids_path, freesurfer_path)
+    dataset_df = dataset_df.loc[(dataset_df['Diagn'] == hc_label) | (dataset_df['Diagn'] == disease_label)]
 
-    classifier_dir = PROJECT_ROOT / 'outputs' / 'classifier_analysis'
-    classifier_dataset_dir = classifier_dir / dataset_name
-    classifier_dataset_analysis_dir = classifier_dataset_dir / '{:02d}_vs_{:02d}'.format(hc_label, disease_label)
-    ids_dir = classifier_dataset_analysis_dir / 'ids'
+    x_cohort = dataset_df[COLUMNS_NAME].values
 
-    classifier_storage_dir = classifier_dataset_analysis_dir / 'models'
-    classifier_storage_dir.mkdir(exist_ok=True)
-    predictions_dir = classifier_dataset_analysis_dir / 'predictions'
-    predictions_dir.mkdir(exist_ok=True)
+    tiv = dataset_df['EstimatedTotalIntraCranialVol'].values
+    tiv = tiv[:, np.newaxis]
+
+    x_cohort = (np.true_divide(x_cohort, tiv)).astype('float32')
+
+    return dataset_df['Image_ID'].values, x_cohort, dataset_df['Diagn'].values
+
+
+def load_bootstrap_indices(ids_dir, image_ids, n_bootstrap):
+    """Get the indices in the cohort of the train and test subjects of each bootstrap iteration.
+
+    The indices are read from the homogeneous_bootstrap_indices.npz archive of classifier_create_ids.py, or from the
+    ids files of each iteration if the archive does not exist.
+    """
+    indices_path = ids_dir / 'homogeneous_bootstrap_indices.npz'
+    positions = pd.Series(np.arange(len(image_ids)), index=image_ids)
+
+    def cohort_index(ids):
+        # As the merge of load_dataset, the subjects without brain regions are dropped
+        index = positions.reindex(ids).values
+        return np.sort(index[~np.isnan(index)]).astype(int)
+
+    resamples = []
+    if indices_path.exists():
+        with np.load(indices_path) as archive:
+            sampled_ids = archive['image_ids']
+            for i_bootstrap, train_indices in enumerate(archive['train_indices'][:n_bootstrap]):
+                test_indices = np.setdiff1d(np.arange(len(sampled_ids)), train_indices)
+                resamples.append((i_bootstrap,
+                                  cohort_index(sampled_ids[train_indices]),
+                                  cohort_index(sampled_ids[test_indices])))
+
+        return resamples
+
+    for i_bootstrap in range(n_bootstrap):
+        ids_train = pd.read_csv(ids_dir / 'homogeneous_bootstrap_{:03d}_train.csv'.format(i_bootstrap))['Image_ID']
+        ids_test = pd.read_csv(ids_dir / 'homogeneous_bootstrap_{:03d}_test.csv'.format(i_bootstrap))['Image_ID']
+        resamples.append((i_bootstrap, cohort_index(ids_train.values), cohort_index(ids_test.values)))
+
+    return resamples
 
-    auc_bootstrap_train = []
-    auc_bootstrap_test = []
-    # ----------------------------------------------------------------------------
-    for i_bootstrap in tqdm(range(n_bootstrap)):
-        ids_filename_train = 'homogeneous_bootstrap_{:03d}_train.csv'.format(i_bootstrap)
-        ids_path_train = ids_dir / ids_filename_train
 
-        dataset_df = load_dataset(participants_path, ids_path_train, freesurfer_path)
+def train_bootstrap_classifier(resample, image_ids, x_cohort, diagnosis, classifier_storage_dir, predictions_dir,
+                               hc_label, disease_label, random_seed=42):
+    """Train the classifier of a bootstrap iteration and save its model and predictions.
 
-        x_data = dataset_df[COLUMNS_NAME].values
+    Each iteration is seeded with `random_seed` + `i_bootstrap`, so the outputs do not depend on the order or on the
+    process in which the iterations are run.
 
-        tiv = dataset_df['EstimatedTotalIntraCranialVol'].values
-        tiv = tiv[:, np.newaxis]
+    Parameters
+    ----------
+    resample: tuple
+        Index of the iteration and the indices of its train and test subjects in the cohort (see load_cohort).
 
-        x_data = (np.true_divide(x_data, tiv)).astype('float32')
+    Returns
+    -------
+    The index of the iteration and its train and test AUCs.
+    """
+    i_bootstrap, train_index, test_index = resample
 
-        x_data = np.concatenate((x_data[dataset_df['Diagn'] == hc_label],
-                                 x_data[dataset_df['Diagn'] == disease_label]), axis=0)
+    np.random.seed(random_seed + i_bootstrap)
+    rn.seed(random_seed + i_bootstrap)
 
-        y_data = np.concatenate((np.zeros(sum(dataset_df['Diagn'] == hc_label)),
-                                 np.ones(sum(dataset_df['Diagn'] == disease_label))))
+    x_data = x_cohort[train_index]
+    diagnosis_data = diagnosis[train_index]
 
-        # Scaling using inter-quartile
-        scaler = RobustScaler()
-        x_data = scaler.fit_transform(x_data)
+    x_data = np.concatenate((x_data[diagnosis_data == hc_label],
+                             x_data[diagnosis_data == disease_label]), axis=0)
 
-        rvm = EMRVC(kernel='linear')
-        rvm.fit(x_data, y_data)
+    y_data = np.concatenate((np.zeros(sum(diagnosis_data == hc_label)),
+                             np.ones(sum(diagnosis_data == disease_label))))
 
-        pred = rvm.predict(x_data)
-        predictions_proba = rvm.predict_proba(x_data)
+    # Scaling using inter-quartile
+    scaler = RobustScaler()
+    x_data = scaler.fit_transform(x_data)
 
-        auc = roc_auc_score(y_data, predictions_proba[:, 1])
+    rvm = EMRVC(kernel='linear')
+    rvm.fit(x_data, y_data)
 
-        auc_bootstrap_train.append(auc)
+    pred = rvm.predict(x_data)
+    predictions_proba = rvm.predict_proba(x_data)
 
-        predictions_df = dataset_df[['Image_ID']].copy()
-        predictions_df['predictions'] = pred
+    auc_train = roc_auc_score(y_data, predictions_proba[:, 1])
 
-        dump(rvm, classifier_storage_dir / '{:03d}_rvr.joblib'.format(i_bootstrap))
-        dump(scaler, classifier_storage_dir / '{:03d}_scaler.joblib'.format(i_bootstrap))
+    predictions_df = pd.DataFrame({'Image_ID': image_ids[train_index]})
+    predictions_df['predictions'] = pred
 
-        # -----------------------------------------------------------------
-        ids_filename_test = 'homogeneous_bootstrap_{:03d}_test.csv'.format(i_bootstrap)
-        ids_path_test = ids_dir / ids_filename_test
+    dump(rvm, classifier_storage_dir / '{:03d}_rvr.joblib'.format(i_bootstrap))
+    dump(scaler, classifier_storage_dir / '{:03d}_scaler.joblib'.format(i_bootstrap))
 
-        dataset_df = load_dataset(participants_path, ids_path_test, freesurfer_path)
+    # -----------------------------------------------------------------
+    x_test = x_cohort[test_index]
+    diagnosis_test = diagnosis[test_index]
 
-        x_test = dataset_df[COLUMNS_NAME].values
+    x_test = np.concatenate((x_test[diagnosis_test == hc_label],
+                             x_test[diagnosis_test == disease_label]), axis=0)
 
-        tiv = dataset_df['EstimatedTotalIntraCranialVol'].values
-        tiv = tiv[:, np.newaxis]
+    y_test = np.concatenate((np.zeros(sum(diagnosis_test == hc_label)),
+                             np.ones(sum(diagnosis_test == disease_label))))
 
-        x_test = (np.true_divide(x_test, tiv)).astype('float32')
+    x_test = scaler.transform(x_test)
 
-        x_test = np.concatenate((x_test[dataset_df['Diagn'] == hc_label],
-                                 x_test[dataset_df['Diagn'] == disease_label]), axis=0)
+    pred = rvm.predict(x_test)
+    predictions_proba = rvm.predict_proba(x_test)
 
-        y_test = np.concatenate((np.zeros(sum(dataset_df['Diagn'] == hc_label)),
-                                 np.ones(sum(dataset_df['Diagn'] == disease_label))))
+    auc_test = roc_auc_score(y_test, predictions_proba[:, 1])
 
-        x_test = scaler.transform(x_test)
+    temp_df = pd.DataFrame({'Image_ID': image_ids[test_index]})
+    temp_df['predictions'] = pred
 
-        pred = rvm.predict(x_test)
-        predictions_proba = rvm.predict_proba(x_test)
+    predictions_df = pd.concat([predictions_df, temp_df], axis=0)
+    predictions_df.to_csv(predictions_dir / 'homogeneous_bootstrap_{:03d}_prediction.csv'.format(i_bootstrap),
+                          index=False)
 
-        auc = roc_auc_score(y_test, predictions_proba[:, 1])
+    return i_bootstrap, auc_train, auc_test
 
-        auc_bootstrap_test.append(auc)
 
-        temp_df = dataset_df[['Image_ID']].copy()
-        temp_df['predictions'] = pred
+def main(dataset_name, disease_label, n_workers=1):
+    """Calculate the performance of the classifier in each iteration of the bootstrap method.
+
+    The brain regions of the contrast are loaded once, and each iteration selects its subjects by their indices.
+
+    With `n_workers` > 1, the iterations are distributed over a pool of worker processes, each one with its share of
+    the cores for its BLAS threads. The AUCs are gathered in the order of the iterations, and the models and
+    predictions are the same as in serial mode.
+    """
+    # ----------------------------------------------------------------------------
+    n_bootstrap = 1000
+
+    participants_path = PROJECT_ROOT / 'data' / dataset_name / 'participants.tsv'
+    freesurfer_path = PROJECT_ROOT / 'data' / dataset_name / 'freesurferData.csv'
+    ids_path = PROJECT_ROOT / 'outputs' / (dataset_name + '_homogeneous_ids.csv')
+
+    hc_label = 1
+
+    # ----------------------------------------------------------------------------
+    # Set random seed
+    random_seed = 42
+
+    classifier_dir = PROJECT_ROOT / 'outputs' / 'classifier_analysis'
+    classifier_dataset_dir = classifier_dir / dataset_name
+    classifier_dataset_analysis_dir = classifier_dataset_dir / '{:02d}_vs_{:02d}'.format(hc_label, disease_label)
+    ids_dir = classifier_dataset_analysis_dir / 'ids'
+
+    classifier_storage_dir = classifier_dataset_analysis_dir / 'models'
+    classifier_storage_dir.mkdir(exist_ok=True)
+    predictions_dir = classifier_dataset_analysis_dir / 'predictions'
+    predictions_dir.mkdir(exist_ok=True)
+
+    # ----------------------------------------------------------------------------
+    image_ids, x_cohort, diagnosis = load_cohort(participants_path, freesurfer_path, ids_path, hc_label, disease_label)
+    resamples = load_bootstrap_indices(ids_dir, image_ids, n_bootstrap)
+
+    train_fn = partial(train_bootstrap_classifier,
+                       image_ids=image_ids,
+                       x_cohort=x_cohort,
+                       diagnosis=diagnosis,
+                       classifier_storage_dir=classifier_storage_dir,
+                       predictions_dir=predictions_dir,
+                       hc_label=hc_label,
+                       disease_label=disease_label,
+                       random_seed=random_seed)
+
+    auc_bootstrap_train = np.zeros(n_bootstrap)
+    auc_bootstrap_test = np.zeros(n_bootstrap)
+    # ----------------------------------------------------------------------------
+    if n_workers == 1:
+        results = map(train_fn, resamples)
+        for i_bootstrap, auc_train, auc_test in tqdm(results, total=n_bootstrap):
+            auc_bootstrap_train[i_bootstrap] = auc_train
+            auc_bootstrap_test[i_bootstrap] = auc_test
 
-        predictions_df = pd.concat([predictions_df, temp_df], axis=0)
-        predictions_df.to_csv(predictions_dir / 'homogeneous_bootstrap_{:03d}_prediction.csv'.format(i_bootstrap),
-                              index=False)
+    else:
+        # The workers inherit the thread pools of the main process, so they would oversubscribe the cores
+        n_threads = max(1, multiprocessing.cpu_count() // n_workers)
+        with multiprocessing.Pool(n_workers, initializer=set_thread_budget, initargs=(n_threads,)) as pool:
+            results = pool.imap_unordered(train_fn, resamples)
+            for i_bootstrap, auc_train, auc_test in tqdm(results, total=n_bootstrap):
+                auc_bootstrap_train[i_bootstrap] = auc_train
+                auc_bootstrap_test[i_bootstrap] = auc_test
 
-    np.save(classifier_dataset_analysis_dir / 'aucs_train.npy', np.array(auc_bootstrap_train))
-    np.save(classifier_dataset_analysis_dir / 'aucs_test.npy', np.array(auc_bootstrap_test))
+    np.save(classifier_dataset_analysis_dir / 'aucs_train.npy', auc_bootstrap_train)
+    np.save(classifier_dataset_analysis_dir / 'aucs_test.npy', auc_bootstrap_test)
 
 
 if __name__ == "__main__":
@@ -133,6 +230,10 @@ if __name__ == "__main__":
                         dest='disease_label',
                         help='Disease label to train the classifiers.',
                         type=int)
+    parser.add_argument('-W', '--n_workers',
+                        dest='n_workers',
+                        help='Number of worker processes used to train the classifiers.',
+                        type=int, default=1)
     args = parser.parse_args()
 
-    main(args.dataset_name, args.disease_label)
+    main(args.dataset_name, args.disease_label, args.n_workers)
@@ -9,31 +9,42 @@ import numpy as np
 PROJECT_ROOT = Path.cwd()
 
 
+def load_normative_aucs(testing_dataset_name, disease_label, hc_label=1):
+    """Load the AUC-ROCs of the bootstrap replicas of the normative model on a dataset."""
+    bootstrap_dir = PROJECT_ROOT / 'outputs' / 'bootstrap_analysis'
+    comparison_dir = bootstrap_dir / testing_dataset_name / ('{:02d}_vs_{:02d}'.format(hc_label, disease_label))
+
+    return pd.read_csv(comparison_dir / 'auc_rocs.csv')['AUC-ROC'].values
+
+
+def save_comparison(generalization_dir, testing_dataset_name, disease_label, normative_aucs, classifier_aucs):
+    """Save the 95% confidence interval of the difference between the AUC-ROCs of the normative model and the ones
+    of the classifiers."""
+    difference = normative_aucs - classifier_aucs
+
+    results = pd.DataFrame({'Measure': ['Lower', 'Upper'],
+                            'Value': [np.percentile(difference, 2.5), np.percentile(difference, 97.5)]})
+    results.to_csv(generalization_dir / 'normative_vs_classifier_{}_{}.csv'.format(testing_dataset_name, disease_label),
+                   index=False)
+
+    return results
+
+
 def main(training_dataset_name, testing_dataset_name, disease_label):
     hc_label = 1
 
-    bootstrap_dir = PROJECT_ROOT / 'outputs' / 'bootstrap_analysis'
-    comparison_dir = bootstrap_dir / testing_dataset_name / ('{:02d}_vs_{:02d}'.format(hc_label, disease_label))
-    normative_auc_roc_df = pd.read_csv(comparison_dir / 'auc_rocs.csv')
-    normative_auc_roc_df = normative_auc_roc_df.rename(columns={'AUC-ROC': 'AUCs'})
+    normative_aucs = load_normative_aucs(testing_dataset_name, disease_label, hc_label)
 
     classifier_dir = PROJECT_ROOT / 'outputs' / 'classifier_analysis' / training_dataset_name
     generalization_dir = classifier_dir / '{:02d}_vs_{:02d}'.format(hc_label, disease_label) / 'generalization'
 
     classifier_results = pd.read_csv(generalization_dir / '{:}_aucs.csv'.format(testing_dataset_name))
 
-    print(np.percentile(normative_auc_roc_df - classifier_results, 2.5))
-    print(np.percentile(normative_auc_roc_df - classifier_results, 97.5))
-
-    results = pd.DataFrame(columns={'Measure', 'Value'})
-    results = results.append({'Measure': 'Lower',
-                              'Value': np.percentile(normative_auc_roc_df - classifier_results, 2.5)},
-                             ignore_index=True)
-    results = results.append({'Measure': 'Upper',
-                              'Value': np.percentile(normative_auc_roc_df - classifier_results, 97.5)},
-                             ignore_index=True)
+    results = save_comparison(generalization_dir, testing_dataset_name, disease_label, normative_aucs,
+                              classifier_results['AUCs'].values)
 
-    results.to_csv(generalization_dir / 'normative_vs_classifier_{}_{}.csv'.format(testing_dataset_name, disease_label), index=False)
+    print(results['Value'][0])
+    print(results['Value'][1])
 
 
 if __name__ == "__main__":
@@ -44,26 +44,22 @@
 # Train normative model
 ./bootstrap_train_aae_supervised.py
 
-# Calculate deviations on clinical data
-./bootstrap_test_aae_supervised.py -D "ADNI"
-./bootstrap_test_aae_supervised.py -D "TOMC"
-./bootstrap_test_aae_supervised.py -D "OASIS1"
-./bootstrap_test_aae_supervised.py -D "AIBL"
-./bootstrap_test_aae_supervised.py -D "MIRIAD"
+# (Optional) Fine-tune the replicas from a base model and compare them with the cold-start replicas
+#./bootstrap_train_aae_supervised.py --warm_start
+#./bootstrap_compare_warm_start.py -D "ADNI" -L 17
 
-# Perform statistical analysis
-./bootstrap_group_analysis_1x1.py -D "ADNI" -L 17
-./bootstrap_group_analysis_1x1.py -D "ADNI" -L 27
-./bootstrap_group_analysis_1x1.py -D "ADNI" -L 28
+# (Optional) Export the replicas to score new subjects without TensorFlow
+#./bootstrap_export_weights.py
+#./bootstrap_score_subjects.py -F "freesurferData.csv" -P "participants.tsv"
 
-./bootstrap_group_analysis_1x1.py -D "TOMC" -L 17
-./bootstrap_group_analysis_1x1.py -D "TOMC" -L 18
+# Calculate deviations on clinical data
+./bootstrap_test_aae_supervised.py -D "ADNI" "TOMC" "OASIS1" "AIBL" "MIRIAD"
 
+# Perform statistical analysis
+./bootstrap_group_analysis_1x1.py -D "ADNI" -L 17 27 28
+./bootstrap_group_analysis_1x1.py -D "TOMC" -L 17 18
 ./bootstrap_group_analysis_1x1.py -D "OASIS1" -L 17
-
-./bootstrap_group_analysis_1x1.py -D "AIBL" -L 17
-./bootstrap_group_analysis_1x1.py -D "AIBL" -L 18
-
+./bootstrap_group_analysis_1x1.py -D "AIBL" -L 17 18
 ./bootstrap_group_analysis_1x1.py -D "MIRIAD" -L 17
 
 # Create Figure 2
@@ -137,61 +133,17 @@
 
 ./classifier_vs_normative.py -D "MIRIAD" -L 17
 
-# Calculate generalization
-./classifier_test.py -D "ADNI" -L 17 -E "OASIS1"
-./classifier_test.py -D "ADNI" -L 17 -E "TOMC"
-./classifier_test.py -D "ADNI" -L 17 -E "MIRIAD"
-./classifier_test.py -D "ADNI" -L 17 -E "AIBL"
-
-./classifier_test.py -D "TOMC" -L 17 -E "ADNI"
-./classifier_test.py -D "TOMC" -L 17 -E "MIRIAD"
-./classifier_test.py -D "TOMC" -L 17 -E "OASIS1"
-./classifier_test.py -D "TOMC" -L 17 -E "AIBL"
-./classifier_test.py -D "TOMC" -L 18 -E "AIBL"
-
-./classifier_test.py -D "OASIS1" -L 17 -E "ADNI"
-./classifier_test.py -D "OASIS1" -L 17 -E "TOMC"
-./classifier_test.py -D "OASIS1" -L 17 -E "MIRIAD"
-./classifier_test.py -D "OASIS1" -L 17 -E "AIBL"
-
-./classifier_test.py -D "AIBL" -L 17 -E "ADNI"
-./classifier_test.py -D "AIBL" -L 17 -E "TOMC"
-./classifier_test.py -D "AIBL" -L 17 -E "OASIS1"
-./classifier_test.py -D "AIBL" -L 17 -E "MIRIAD"
-./classifier_test.py -D "AIBL" -L 18 -E "TOMC"
-
-./classifier_test.py -D "MIRIAD" -L 17 -E "ADNI"
-./classifier_test.py -D "MIRIAD" -L 17 -E "TOMC"
-./classifier_test.py -D "MIRIAD" -L 17 -E "OASIS1"
-./classifier_test.py -D "MIRIAD" -L 17 -E "AIBL"
-
-
-./classifier_vs_normative_generalization.py -D "ADNI" -L 17 -E "OASIS1"
-./classifier_vs_normative_generalization.py -D "ADNI" -L 17 -E "TOMC"
-./classifier_vs_normative_generalization.py -D "ADNI" -L 17 -E "MIRIAD"
-./classifier_vs_normative_generalization.py -D "ADNI" -L 17 -E "AIBL"
-
-./classifier_vs_normative_generalization.py -D "TOMC" -L 17 -E "ADNI"
-./classifier_vs_normative_generalization.py -D "TOMC" -L 17 -E "MIRIAD"
-./classifier_vs_normative_generalization.py -D "TOMC" -L 17 -E "OASIS1"
-./classifier_vs_normative_generalization.py -D "TOMC" -L 17 -E "AIBL"
-./classifier_vs_normative_generalization.py -D "TOMC" -L 18 -E "AIBL"
-
-./classifier_vs_normative_generalization.py -D "OASIS1" -L 17 -E "ADNI"
-./classifier_vs_normative_generalization.py -D "OASIS1" -L 17 -E "TOMC"
-./classifier_vs_normative_generalization.py -D "OASIS1" -L 17 -E "MIRIAD"
-./classifier_vs_normative_generalization.py -D "OASIS1" -L 17 -E "AIBL"
-
-./classifier_vs_normative_generalization.py -D "AIBL" -L 17 -E "ADNI"
-./classifier_vs_normative_generalization.py -D "AIBL" -L 17 -E "TOMC"
-./classifier_vs_normative_generalization.py -D "AIBL" -L 17 -E "OASIS1"
-./classifier_vs_normative_generalization.py -D "AIBL" -L 17 -E "MIRIAD"
-./classifier_vs_normative_generalization.py -D "AIBL" -L 18 -E "TOMC"
-
-./classifier_vs_normative_generalization.py -D "MIRIAD" -L 17 -E "ADNI"
-./classifier_vs_normative_generalization.py -D "MIRIAD" -L 17 -E "TOMC"
-./classifier_vs_normative_generalization.py -D "MIRIAD" -L 17 -E "OASIS1"
-./classifier_vs_normative_generalization.py -D "MIRIAD" -L 17 -E "AIBL"
+# Export the linear classifiers
+./classifier_export_weights.py -D "ADNI" -L 17
+./classifier_export_weights.py -D "TOMC" -L 17
+./classifier_export_weights.py -D "TOMC" -L 18
+./classifier_export_weights.py -D "OASIS1" -L 17
+./classifier_export_weights.py -D "AIBL" -L 17
+./classifier_export_weights.py -D "AIBL" -L 18
+./classifier_export_weights.py -D "MIRIAD" -L 17
+
+# Calculate generalization of the classifiers and comparison with the normative model
+./classifier_generalization_matrix.py -D "ADNI" "TOMC" "OASIS1" "AIBL" "MIRIAD" -L 17 18
 
 # --------------------------- Misc -----------------------------------------------
 # Perform mass-univariate analysis
@@ -0,0 +1,80 @@
+"""Binary store of the outputs of the bootstrap replicas on a clinical dataset.
+
+The outputs of all the replicas are saved in float32 .npy arrays of shape [replica, subject, ...], with the
+participant ids and the names of the brain regions as indexes. The arrays are opened as memory maps, so the analysis
+scripts read the slices they need without parsing text files.
+"""
+import numpy as np
+
+ARRAY_NAMES = ['normalized', 'reconstruction', 'encoded', 'reconstruction_error']
+
+
+class DeviationStore(object):
+    """Outputs of the bootstrap replicas on a dataset (see bootstrap_test_aae_supervised.py).
+
+    Parameters
+    ----------
+    store_dir: PosixPath
+        Directory of the store.
+    mode: str
+        Memory map mode of the arrays ('r' to read, 'r+' to update).
+
+    Attributes
+    ----------
+    participant_id: numpy.ndarray
+        Id of each subject.
+    regions: numpy.ndarray
+        Name of each brain region.
+    normalized, reconstruction: numpy.memmap
+        Normalized brain regions and their reconstructions, with shape [n_replicas, n_subjects, n_regions].
+    encoded: numpy.memmap
+        Latent codes, with shape [n_replicas, n_subjects, z_dim].
+    reconstruction_error: numpy.memmap
+        Mean squared error of the reconstructions, with shape [n_replicas, n_subjects].
+    """
+
+    def __init__(self, store_dir, mode='r'):
+        self.store_dir = store_dir
+        self.participant_id = np.load(store_dir / 'participant_id.npy')
+        self.regions = np.load(store_dir / 'regions.npy')
+
+        for name in ARRAY_NAMES:
+            setattr(self, name, np.load(store_dir / (name + '.npy'), mmap_mode=mode))
+
+    @classmethod
+    def create(cls, store_dir, participant_id, regions, n_replicas, z_dim):
+        """Create an empty store (filled with zeros) and open it for writing."""
+        store_dir.mkdir(parents=True, exist_ok=True)
+        np.save(store_dir / 'participant_id.npy', np.asarray(participant_id, dtype=str))
+        np.save(store_dir / 'regions.npy', np.asarray(regions, dtype=str))
+
+        n_subjects = len(participant_id)
+        shapes = {'normalized': (n_replicas, n_subjects, len(regions)),
+                  'reconstruction': (n_replicas, n_subjects, len(regions)),
+                  'encoded': (n_replicas, n_subjects, z_dim),
+                  'reconstruction_error': (n_replicas, n_subjects)}
+
+        for name in ARRAY_NAMES:
+            array = np.lib.format.open_memmap(store_dir / (name + '.npy'), mode='w+', dtype='float32',
+                                              shape=shapes[name])
+            del array
+
+        return cls(store_dir, mode='r+')
+
+    def write(self, i_start, x_normalized, encoded, reconstruction):
+        """Write the outputs of the consecutive replicas starting at `i_start` (as returned by StackedAAE.predict)."""
+        i_end = i_start + len(x_normalized)
+
+        self.normalized[i_start:i_end] = x_normalized
+        self.reconstruction[i_start:i_end] = reconstruction
+        self.encoded[i_start:i_end] = encoded
+        self.reconstruction_error[i_start:i_end] = np.mean((x_normalized - reconstruction) ** 2, axis=2)
+
+    def flush(self):
+        for name in ARRAY_NAMES:
+            getattr(self, name).flush()
+
+    def subject_indices(self, participant_id):
+        """Get the position in the store of each participant, to align the outputs with the demographic data."""
+        positions = {subject_id: i_subject for i_subject, subject_id in enumerate(self.participant_id)}
+        return np.array([positions[subject_id] for subject_id in participant_id], dtype=int)
@@ -0,0 +1,221 @@
+"""Ensemble of supervised adversarial autoencoders trained as a single model.
+
+The weights of the K members are stacked along a leading axis ([K, in, out] kernels and [K, 1, out] biases), so each
+layer of all the members is computed with one batched matrix multiplication. The members are independent: each one
+gets its own bootstrap batches and the loss minimised is the sum of the members' losses, so the gradients of a member
+only depend on its own loss. Adam works element-wise, so one optimizer over the stacked weights is the same as one
+optimizer per member.
+
+A whole epoch is run inside the graph (see `_train_epoch`), like `AAETrainer.train_epoch`: each member's bootstrapped
+sample is shuffled with its own seed, and the batches are gathered and the running means of the losses are updated on
+the device, without going back to Python for each batch.
+"""
+import numpy as np
+import tensorflow as tf
+
+from models import make_encoder_model_v1, make_decoder_model_v1, make_discriminator_model_v1
+
+
+def glorot_uniform(random_state, fan_in, fan_out):
+    """Draw a kernel like keras' default initializer (Glorot uniform)."""
+    limit = np.sqrt(6. / (fan_in + fan_out))
+    return random_state.uniform(-limit, limit, size=(fan_in, fan_out)).astype('float32')
+
+
+def make_stacked_mlp(random_states, n_inputs, h_dim, n_outputs):
+    """Creates the stacked weights of the multilayer perceptrons of models.py, one per random state."""
+    layers_dim = [n_inputs] + list(h_dim) + [n_outputs]
+
+    weights = []
+    for fan_in, fan_out in zip(layers_dim[:-1], layers_dim[1:]):
+        kernel = np.stack([glorot_uniform(random_state, fan_in, fan_out) for random_state in random_states])
+        bias = np.zeros((len(random_states), 1, fan_out), dtype='float32')
+
+        weights.append(tf.Variable(kernel))
+        weights.append(tf.Variable(bias))
+
+    return weights
+
+
+def stacked_mlp(weights, x):
+    """Forward pass of the stacked multilayer perceptrons, with x of shape [K, batch, features]."""
+    n_layers = len(weights) // 2
+    for i_layer in range(n_layers):
+        x = tf.matmul(x, weights[2 * i_layer]) + weights[2 * i_layer + 1]
+        if i_layer < n_layers - 1:
+            # Same slope as keras.layers.LeakyReLU()
+            x = tf.nn.leaky_relu(x, alpha=0.3)
+
+    return x
+
+
+def unstack_weights(weights, i_member):
+    """Get the weights of one member in the order used by keras.Model.set_weights."""
+    member_weights = []
+    for i_layer in range(len(weights) // 2):
+        member_weights.append(weights[2 * i_layer][i_member].numpy())
+        member_weights.append(weights[2 * i_layer + 1][i_member, 0].numpy())
+
+    return member_weights
+
+
+class EnsembleAAE(object):
+    """K supervised adversarial autoencoders with stacked weights.
+
+    Parameters
+    ----------
+    random_states: list of numpy.random.RandomState
+        Random state used to initialize each member.
+    n_features: int
+        Number of brain regions.
+    n_labels: int
+        Number of columns of the one-hot encoded demographic data.
+    h_dim: list of int
+        Number of neurons of the hidden layers.
+    z_dim: int
+        Dimension of the latent code.
+    learning_rate: float or tf.keras.optimizers.schedules.LearningRateSchedule
+        Learning rate of the optimizers.
+    """
+
+    def __init__(self, random_states, n_features, n_labels, h_dim, z_dim, learning_rate):
+        self.n_members = len(random_states)
+        self.n_features = n_features
+        self.n_labels = n_labels
+        self.h_dim = h_dim
+        self.z_dim = z_dim
+
+        # Same creation order as the single model training (encoder, decoder and discriminator)
+        self.encoder_weights = make_stacked_mlp(random_states, n_features, h_dim, z_dim)
+        self.decoder_weights = make_stacked_mlp(random_states, z_dim + n_labels, h_dim, n_features)
+        self.discriminator_weights = make_stacked_mlp(random_states, z_dim, h_dim, 1)
+
+        self.ae_optimizer = tf.keras.optimizers.Adam(learning_rate=learning_rate)
+        self.dc_optimizer = tf.keras.optimizers.Adam(learning_rate=learning_rate)
+        self.gen_optimizer = tf.keras.optimizers.Adam(learning_rate=learning_rate)
+
+        # Running discriminator accuracy of each member (like tf.keras.metrics.BinaryAccuracy)
+        self.dc_acc_total = tf.Variable(tf.zeros([self.n_members]))
+        self.dc_acc_count = tf.Variable(tf.zeros([self.n_members]))
+
+        # Seed of the shuffling of each member, so the order of a member's batches does not depend on the other members
+        self.shuffle_seeds = [random_state.randint(np.iinfo(np.int32).max) for random_state in random_states]
+
+        # Number of epochs completed, used with the members' seeds to draw a new permutation for each epoch
+        self.epoch = tf.Variable(0, dtype=tf.int64, trainable=False)
+
+        self.epoch_ae_loss_avg = tf.metrics.Mean()
+        self.epoch_dc_loss_avg = tf.metrics.Mean()
+        self.epoch_dc_acc_avg = tf.metrics.Mean()
+        self.epoch_gen_loss_avg = tf.metrics.Mean()
+
+        self.train_step = tf.function(self._train_step)
+        self.train_epoch = tf.function(self._train_epoch)
+
+    def _train_step(self, x, y, batch_indices):
+        """Train all the members on one batch each.
+
+        Parameters
+        ----------
+        x: Tensor
+            Normalized brain regions of each member, with shape [K, n_samples, n_features].
+        y: Tensor
+            One-hot encoded demographic data of each member, with shape [K, n_samples, n_labels].
+        batch_indices: Tensor
+            Indices of the samples of each member's batch, with shape [K, batch_size].
+
+        Returns
+        -------
+        The autoencoder, discriminator and generator losses and the discriminator accuracy of each member.
+        """
+        batch_x = tf.gather(x, batch_indices, batch_dims=1)
+        batch_y = tf.gather(y, batch_indices, batch_dims=1)
+
+        # -------------------------------------------------------------------------------------------------------------
+        # Autoencoder
+        with tf.GradientTape() as ae_tape:
+            encoder_output = stacked_mlp(self.encoder_weights, batch_x)
+            decoder_output = stacked_mlp(self.decoder_weights, tf.concat([encoder_output, batch_y], axis=2))
+
+            # Autoencoder loss
+            ae_loss = tf.reduce_mean(tf.square(batch_x - decoder_output), axis=[1, 2])
+            # The sum has to be recorded by the tape
+            ae_loss_sum = tf.reduce_sum(ae_loss)
+
+        ae_variables = self.encoder_weights + self.decoder_weights
+        ae_grads = ae_tape.gradient(ae_loss_sum, ae_variables)
+        self.ae_optimizer.apply_gradients(zip(ae_grads, ae_variables))
+
+        # -------------------------------------------------------------------------------------------------------------
+        # Discriminator
+        with tf.GradientTape() as dc_tape:
+            real_distribution = tf.random.normal([self.n_members, tf.shape(batch_x)[1], self.z_dim],
+                                                 mean=0.0, stddev=1.0)
+            encoder_output = stacked_mlp(self.encoder_weights, batch_x)
+
+            dc_real = stacked_mlp(self.discriminator_weights, real_distribution)
+            dc_fake = stacked_mlp(self.discriminator_weights, encoder_output)
+
+            # Discriminator Loss
+            loss_real = tf.nn.sigmoid_cross_entropy_with_logits(labels=tf.ones_like(dc_real), logits=dc_real)
+            loss_fake = tf.nn.sigmoid_cross_entropy_with_logits(labels=tf.zeros_like(dc_fake), logits=dc_fake)
+            dc_loss = tf.reduce_mean(loss_real, axis=[1, 2]) + tf.reduce_mean(loss_fake, axis=[1, 2])
+            dc_loss_sum = tf.reduce_sum(dc_loss)
+
+        dc_grads = dc_tape.gradient(dc_loss_sum, self.discriminator_weights)
+        self.dc_optimizer.apply_gradients(zip(dc_grads, self.discriminator_weights))
+
+        # Discriminator Acc
+        correct = tf.concat([tf.cast(dc_real > 0.5, tf.float32), tf.cast(dc_fake <= 0.5, tf.float32)], axis=1)
+        self.dc_acc_total.assign_add(tf.reduce_sum(correct, axis=[1, 2]))
+        self.dc_acc_count.assign_add(tf.cast(tf.fill([self.n_members], tf.shape(correct)[1]), tf.float32))
+        dc_acc = self.dc_acc_total / self.dc_acc_count
+
+        # -------------------------------------------------------------------------------------------------------------
+        # Generator (Encoder)
+        with tf.GradientTape() as gen_tape:
+            encoder_output = stacked_mlp(self.encoder_weights, batch_x)
+            dc_fake = stacked_mlp(self.discriminator_weights, encoder_output)
+
+            # Generator loss
+            gen_loss = tf.reduce_mean(tf.nn.sigmoid_cross_entropy_with_logits(labels=tf.ones_like(dc_fake),
+                                                                              logits=dc_fake), axis=[1, 2])
+            gen_loss_sum = tf.reduce_sum(gen_loss)
+
+        gen_grads = gen_tape.gradient(gen_loss_sum, self.encoder_weights)
+        self.gen_optimizer.apply_gradients(zip(gen_grads, self.encoder_weights))
+
+        return ae_loss, dc_loss, dc_acc, gen_loss
+
+    def _train_epoch(self, x, y, batch_size):
+        """Train all the members for one epoch over their reshuffled data, updating the running means of the losses.
+
+        The means are over the members and the batches, and have to be reset by the caller before each epoch.
+        """
+        n_samples = tf.shape(x)[1]
+        permutations = tf.stack([tf.argsort(tf.random.stateless_uniform([n_samples], seed=[shuffle_seed, self.epoch]))
+                                 for shuffle_seed in self.shuffle_seeds])
+
+        for i_start in tf.range(0, n_samples, batch_size):
+            batch_indices = permutations[:, i_start:i_start + batch_size]
+
+            ae_loss, dc_loss, dc_acc, gen_loss = self._train_step(x, y, batch_indices)
+
+            self.epoch_ae_loss_avg(ae_loss)
+            self.epoch_dc_loss_avg(dc_loss)
+            self.epoch_dc_acc_avg(dc_acc)
+            self.epoch_gen_loss_avg(gen_loss)
+
+        self.epoch.assign_add(1)
+
+    def get_member_models(self, i_member):
+        """Creates the keras encoder, decoder and discriminator of one member (same networks as in models.py)."""
+        encoder = make_encoder_model_v1(self.n_features, self.h_dim, self.z_dim)
+        decoder = make_decoder_model_v1(self.z_dim + self.n_labels, self.n_features, self.h_dim)
+        discriminator = make_discriminator_model_v1(self.z_dim, self.h_dim)
+
+        encoder.set_weights(unstack_weights(self.encoder_weights, i_member))
+        decoder.set_weights(unstack_weights(self.decoder_weights, i_member))
+        discriminator.set_weights(unstack_weights(self.discriminator_weights, i_member))
+
+        return encoder, decoder, discriminator
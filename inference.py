@@ -0,0 +1,186 @@
+"""Inference of the bootstrap replicas of the supervised adversarial autoencoder with stacked weights.
+
+Loading the Keras models takes much longer than their forward pass. Here, the weights are read directly from the .h5
+files (without building the models) and the weights of the replicas are stacked along a leading axis, so all the
+replicas are computed at once with batched matrix multiplications.
+
+The replicas can also be exported to .npz archives (see bootstrap_export_weights.py) and scored with NumPy only:
+h5py, joblib and scikit-learn are only imported to read the files saved by the training.
+"""
+import numpy as np
+
+# Names of the arrays of the .npz archives besides the weights
+REPLICA_ARRAYS = ['center', 'scale', 'age_categories', 'gender_categories']
+
+
+def load_dense_weights(model_path):
+    """Read the kernels and biases of a Keras model saved in HDF5, in the order of its layers."""
+    import h5py
+
+    weights = []
+    with h5py.File(str(model_path), 'r') as model_file:
+        model_weights = model_file['model_weights']
+        for layer_name in model_weights.attrs['layer_names']:
+            layer_group = model_weights[layer_name]
+            for weight_name in layer_group.attrs['weight_names']:
+                weights.append(np.asarray(layer_group[weight_name], dtype='float32'))
+
+    return weights
+
+
+def load_replica(bootstrap_model_dir):
+    """Load the weights of the encoder and the decoder of a bootstrap replica with its scaler and encoders."""
+    import joblib
+
+    scaler = joblib.load(bootstrap_model_dir / 'scaler.joblib')
+
+    return {'encoder': load_dense_weights(bootstrap_model_dir / 'encoder.h5'),
+            'decoder': load_dense_weights(bootstrap_model_dir / 'decoder.h5'),
+            'center': scaler.center_,
+            'scale': scaler.scale_,
+            'age_categories': joblib.load(bootstrap_model_dir / 'age_encoder.joblib').categories_[0],
+            'gender_categories': joblib.load(bootstrap_model_dir / 'gender_encoder.joblib').categories_[0]}
+
+
+def save_replica_npz(npz_path, replica, regions):
+    """Save the weights, the scaler parameters and the demographic categories of a replica in a .npz archive, with
+    the names of the brain regions of its inputs."""
+    arrays = {name: replica[name] for name in REPLICA_ARRAYS}
+    arrays['regions'] = np.asarray(regions, dtype=str)
+    for model_name in ['encoder', 'decoder']:
+        for i_weight, weight in enumerate(replica[model_name]):
+            arrays['{}_{:d}'.format(model_name, i_weight)] = weight
+
+    np.savez(npz_path, **arrays)
+
+
+def load_replica_npz(npz_path):
+    """Load a replica saved by save_replica_npz (same format as load_replica)."""
+    with np.load(npz_path) as archive:
+        replica = {name: archive[name] for name in REPLICA_ARRAYS}
+        for model_name in ['encoder', 'decoder']:
+            n_weights = len([name for name in archive.files if name.startswith(model_name + '_')])
+            replica[model_name] = [archive['{}_{:d}'.format(model_name, i_weight)] for i_weight in range(n_weights)]
+
+    return replica
+
+
+def load_regions_npz(npz_path):
+    """Load the names of the brain regions of the inputs of a replica saved by save_replica_npz."""
+    with np.load(npz_path) as archive:
+        return list(archive['regions'])
+
+
+def leaky_relu(x, alpha=0.3):
+    """Same slope as keras.layers.LeakyReLU()."""
+    return np.where(x > 0, x, alpha * x)
+
+
+def stacked_mlp(kernels, biases, x):
+    """Forward pass of the stacked multilayer perceptrons of models.py, with x of shape [K, n_subjects, n_inputs]."""
+    n_layers = len(kernels)
+    for i_layer in range(n_layers):
+        x = np.matmul(x, kernels[i_layer]) + biases[i_layer]
+        if i_layer < n_layers - 1:
+            x = leaky_relu(x)
+
+    return x
+
+
+def category_indices(categories, values, known):
+    """Get the index of each value in `categories`, checking that all the replicas know it (as OneHotEncoder)."""
+    indices = np.minimum(np.searchsorted(categories, values), len(categories) - 1)
+    if not np.array_equal(categories[indices], values) or not np.all(known[:, indices]):
+        raise ValueError('Found unknown categories during transform.')
+
+    return indices
+
+
+class StackedAAE(object):
+    """Encoders and decoders of several bootstrap replicas with stacked weights.
+
+    The replicas may have seen different ages (the one-hot encoded ages have different lengths), so the first kernel
+    of the decoders is split in the rows of the latent code and the rows of each category. The rows of the categories
+    are aligned on the categories of all the replicas (with zeros where a replica does not have a category), and
+    multiplying a one-hot vector by them is a look-up.
+
+    Parameters
+    ----------
+    replicas: list of dict
+        Weights, scaler parameters and demographic categories of each replica (see load_replica).
+    """
+
+    def __init__(self, replicas):
+        self.n_replicas = len(replicas)
+
+        self.encoder_kernels = [np.stack(kernels) for kernels in zip(*[replica['encoder'][0::2]
+                                                                      for replica in replicas])]
+        self.encoder_biases = [np.stack(biases)[:, np.newaxis] for biases in zip(*[replica['encoder'][1::2]
+                                                                                  for replica in replicas])]
+        self.z_dim = self.encoder_kernels[-1].shape[2]
+
+        # The first kernel of the decoders is split below
+        self.decoder_kernels = [np.stack(kernels) for kernels in zip(*[replica['decoder'][2::2]
+                                                                      for replica in replicas])]
+        self.decoder_biases = [np.stack(biases)[:, np.newaxis] for biases in zip(*[replica['decoder'][1::2]
+                                                                                  for replica in replicas])]
+
+        first_kernels = [replica['decoder'][0] for replica in replicas]
+        self.decoder_z_kernel = np.stack([kernel[:self.z_dim] for kernel in first_kernels])
+
+        # Rows of the first kernel of the decoders for each age and gender
+        self.age_categories = np.unique(np.concatenate([replica['age_categories'] for replica in replicas]))
+        self.gender_categories = np.unique(np.concatenate([replica['gender_categories'] for replica in replicas]))
+
+        n_hidden = self.decoder_z_kernel.shape[2]
+        self.age_rows = np.zeros((self.n_replicas, len(self.age_categories), n_hidden), dtype='float32')
+        self.gender_rows = np.zeros((self.n_replicas, len(self.gender_categories), n_hidden), dtype='float32')
+        self.age_known = np.zeros((self.n_replicas, len(self.age_categories)), dtype=bool)
+        self.gender_known = np.zeros((self.n_replicas, len(self.gender_categories)), dtype=bool)
+
+        for i_replica, (replica, kernel) in enumerate(zip(replicas, first_kernels)):
+            n_ages = len(replica['age_categories'])
+            age_indices = np.searchsorted(self.age_categories, replica['age_categories'])
+            gender_indices = np.searchsorted(self.gender_categories, replica['gender_categories'])
+
+            self.age_rows[i_replica, age_indices] = kernel[self.z_dim:self.z_dim + n_ages]
+            self.gender_rows[i_replica, gender_indices] = kernel[self.z_dim + n_ages:]
+            self.age_known[i_replica, age_indices] = True
+            self.gender_known[i_replica, gender_indices] = True
+
+        # RobustScaler parameters
+        self.center = np.stack([replica['center'] for replica in replicas])[:, np.newaxis]
+        self.scale = np.stack([replica['scale'] for replica in replicas])[:, np.newaxis]
+
+    def predict(self, x, age, gender):
+        """Normalize, encode and reconstruct the brain regions of the subjects with all the replicas.
+
+        Parameters
+        ----------
+        x: numpy.ndarray
+            Brain regions divided by the total intracranial volume, with shape [n_subjects, n_features].
+        age: numpy.ndarray
+            Age of each subject.
+        gender: numpy.ndarray
+            Gender of each subject.
+
+        Returns
+        -------
+        The normalized brain regions, the latent codes and the reconstructions of shape [n_replicas, n_subjects, ...].
+        """
+        age_indices = category_indices(self.age_categories, np.asarray(age, dtype='float32'), self.age_known)
+        gender_indices = category_indices(self.gender_categories, np.asarray(gender, dtype='float32'),
+                                          self.gender_known)
+
+        # Same rounding as RobustScaler.transform on float32 data
+        x_normalized = (np.asarray(x, dtype='float32') - self.center).astype('float32')
+        x_normalized = (x_normalized / self.scale).astype('float32')
+
+        encoded = stacked_mlp(self.encoder_kernels, self.encoder_biases, x_normalized)
+
+        # First layer of the decoders, with the one-hot encoded demographic data as look-ups
+        hidden = (np.matmul(encoded, self.decoder_z_kernel) +
+                  self.age_rows[:, age_indices] + self.gender_rows[:, gender_indices] + self.decoder_biases[0])
+        reconstruction = stacked_mlp(self.decoder_kernels, self.decoder_biases[1:], leaky_relu(hidden))
+
+        return x_normalized, encoded, reconstruction
@@ -0,0 +1,122 @@
+"""Overlap of the disk input/output with the computations of the bootstrap loops.
+
+`prefetch` loads the next items on a thread pool while the current item is computed, and `AsyncWriter` saves the
+outputs on a separate thread. Both record in a PipelineStats how long the main loop waited for them (stall time) and
+how many items were ready or pending (queue depth), to tune the number of workers and the size of the queues.
+"""
+import queue
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+
+class PipelineStats(object):
+    """Stall time and queue depths of a stage of the pipeline."""
+
+    def __init__(self, name):
+        self.name = name
+        self.n_items = 0
+        self.stall_time = 0.0
+        self.queue_depths = []
+
+    def record(self, stall_time, queue_depth):
+        self.n_items += 1
+        self.stall_time += stall_time
+        self.queue_depths.append(queue_depth)
+
+    def summary(self):
+        mean_depth = sum(self.queue_depths) / len(self.queue_depths) if self.queue_depths else 0.0
+        max_depth = max(self.queue_depths) if self.queue_depths else 0
+
+        return '{}: {:d} items, STALL TIME: {:.2f}s, QUEUE DEPTH: mean {:.2f} max {:d}'.format(
+            self.name.upper(), self.n_items, self.stall_time, mean_depth, max_depth)
+
+
+def prefetch(load_fn, items, n_workers=2, depth=2, stats=None):
+    """Yield (item, load_fn(item)) in the order of `items`, loading up to `depth` items ahead on a thread pool.
+
+    The stall time is the time spent waiting for an item that was not loaded yet, and the queue depth is the number
+    of items already loaded when an item is requested.
+    """
+    items = iter(items)
+    pending = deque()
+
+    with ThreadPoolExecutor(max_workers=n_workers) as executor:
+        def submit_next():
+            for item in items:
+                pending.append((item, executor.submit(load_fn, item)))
+                return
+
+        for _ in range(depth):
+            submit_next()
+
+        while pending:
+            item, future = pending.popleft()
+
+            queue_depth = int(future.done()) + sum(int(other_future.done()) for _, other_future in pending)
+            start = time.time()
+            result = future.result()
+            if stats is not None:
+                stats.record(time.time() - start, queue_depth)
+
+            submit_next()
+
+            yield item, result
+
+
+class AsyncWriter(object):
+    """Run the functions saving the outputs on a background thread, with at most `max_pending` waiting functions.
+
+    The stall time is the time spent waiting for a free place in the queue, and the queue depth is the number of
+    functions waiting when a function is submitted. An exception raised by a function is raised again by `close`.
+    """
+
+    def __init__(self, max_pending=4, stats=None):
+        self.stats = stats
+        self.error = None
+        self.queue = queue.Queue(maxsize=max_pending)
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    def _run(self):
+        while True:
+            task = self.queue.get()
+            if task is None:
+                break
+
+            fn, args, kwargs = task
+            if self.error is None:
+                try:
+                    fn(*args, **kwargs)
+                except Exception as error:
+                    self.error = error
+
+    def submit(self, fn, *args, **kwargs):
+        """Call fn(*args, **kwargs) on the writer thread. The arguments must not be modified afterwards."""
+        if self.error is not None:
+            raise self.error
+
+        queue_depth = self.queue.qsize()
+        start = time.time()
+        self.queue.put((fn, args, kwargs))
+        if self.stats is not None:
+            self.stats.record(time.time() - start, queue_depth)
+
+    def close(self):
+        """Wait for the pending functions to finish."""
+        self.queue.put(None)
+        self.thread.join()
+
+        if self.error is not None:
+            raise self.error
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
+        else:
+            self.queue.put(None)
+            self.thread.join()
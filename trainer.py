@@ -0,0 +1,503 @@
+"""Trainer of the supervised adversarial autoencoder that can be reused across bootstrap replicas."""
+import time
+
+import numpy as np
+import tensorflow as tf
+
+from models import make_encoder_model_v1, make_decoder_model_v1, make_discriminator_model_v1
+
+
+class CyclicalLearningRate(tf.keras.optimizers.schedules.LearningRateSchedule):
+    """Triangular cyclical learning rate whose amplitude decays exponentially with the cycles.
+
+    The step size is a variable, so it can be changed without tracing again the functions using the schedule.
+
+    Parameters
+    ----------
+    base_lr: float
+        Minimum learning rate.
+    max_lr: float
+        Maximum learning rate (of the first cycle).
+    step_size: float
+        Number of training steps in half a cycle.
+    gamma: float
+        Decay of the amplitude for each cycle.
+    """
+
+    def __init__(self, base_lr, max_lr, step_size, gamma):
+        super(CyclicalLearningRate, self).__init__()
+        self.base_lr = base_lr
+        self.max_lr = max_lr
+        self.step_size = tf.Variable(step_size, dtype=tf.float64, trainable=False)
+        self.gamma = gamma
+
+    def __call__(self, step):
+        # The optimizers' iterations start at 0, while the first training step is the global step 1. The schedule is
+        # computed in double precision like the NumPy version used before.
+        global_step = tf.cast(step, tf.float64) + 1
+        cycle = tf.floor(1 + global_step / (2 * self.step_size))
+        x_lr = tf.abs(global_step / self.step_size - 2 * cycle + 1)
+        scale = tf.pow(tf.constant(self.gamma, tf.float64), cycle)
+        clr = self.base_lr + (self.max_lr - self.base_lr) * tf.maximum(1 - x_lr, 0.) * scale
+        return tf.cast(clr, tf.float32)
+
+    def get_config(self):
+        return {'base_lr': self.base_lr,
+                'max_lr': self.max_lr,
+                'step_size': float(self.step_size.numpy()),
+                'gamma': self.gamma}
+
+
+class ConvergenceMonitor(tf.Module):
+    """Stop the training when the autoencoder loss and the discriminator accuracy reach a plateau.
+
+    After each epoch, the autoencoder loss is compared with the best loss so far and the discriminator accuracy with
+    the accuracy of the last change of the adversarial game. The training has converged when neither of them changed
+    for `patience` epochs and at least `min_epochs` epochs were run. The state is kept in variables, so it can be saved
+    in the checkpoints of the trainer.
+
+    Parameters
+    ----------
+    patience: int
+        Number of epochs without change before stopping.
+    min_delta: float
+        Minimum decrease of the autoencoder loss counted as an improvement.
+    min_epochs: int
+        Minimum number of epochs.
+    dc_acc_delta: float
+        Minimum change of the discriminator accuracy counted as a change.
+    """
+
+    def __init__(self, patience=20, min_delta=0.001, min_epochs=50, dc_acc_delta=0.02):
+        super(ConvergenceMonitor, self).__init__()
+        self.patience = patience
+        self.min_delta = min_delta
+        self.min_epochs = min_epochs
+        self.dc_acc_delta = dc_acc_delta
+
+        self.best_ae_loss = tf.Variable(np.inf, dtype=tf.float32, trainable=False)
+        self.reference_dc_acc = tf.Variable(np.nan, dtype=tf.float32, trainable=False)
+        self.wait = tf.Variable(0, dtype=tf.int64, trainable=False)
+        # Result of the last update, so a training resumed from the epoch where it converged is not continued
+        self.converged = tf.Variable(False, trainable=False)
+
+    def reset(self):
+        self.best_ae_loss.assign(np.inf)
+        self.reference_dc_acc.assign(np.nan)
+        self.wait.assign(0)
+        self.converged.assign(False)
+
+    def update(self, n_epochs_done, ae_loss, dc_acc):
+        """Update the monitor with the mean losses of the last epoch and return True if the training converged."""
+        changed = False
+        if ae_loss < self.best_ae_loss.numpy() - self.min_delta:
+            self.best_ae_loss.assign(ae_loss)
+            changed = True
+
+        # The first epoch always sets the reference accuracy (comparisons with NaN are False)
+        if not np.abs(dc_acc - self.reference_dc_acc.numpy()) <= self.dc_acc_delta:
+            self.reference_dc_acc.assign(dc_acc)
+            changed = True
+
+        if changed:
+            self.wait.assign(0)
+        else:
+            self.wait.assign_add(1)
+
+        self.converged.assign(n_epochs_done >= self.min_epochs and int(self.wait) >= self.patience)
+
+        return bool(self.converged.numpy())
+
+
+class AAETrainer(object):
+    """Supervised adversarial autoencoder with its losses, optimizers and training graph.
+
+    The models and the training graph are built (and traced) only once. Between replicas, `reset` re-initialises the
+    weights, the optimizers' slots and the random number generator in place, so the graph can be reused. `reset` must
+    be called before the first training, since the graph is executed once at construction to measure its compilation.
+
+    A whole epoch is run inside the graph (see `_train_epoch`): the shuffling, the batching, the learning rate schedule
+    and the running means of the losses are computed on the device, without going back to Python for each batch.
+
+    Parameters
+    ----------
+    n_features: int
+        Number of brain regions.
+    n_labels: int
+        Number of columns of the one-hot encoded demographic data.
+    h_dim: list of int
+        Number of neurons of the hidden layers.
+    z_dim: int
+        Dimension of the latent code.
+    base_lr: float
+        Minimum learning rate of the cyclical learning rate.
+    max_lr: float
+        Maximum learning rate of the cyclical learning rate.
+    gamma: float
+        Decay of the amplitude of the cyclical learning rate for each cycle.
+    fused: bool
+        If True, use the fused training step (see `_fused_train_step`).
+    """
+
+    def __init__(self, n_features, n_labels, h_dim, z_dim, base_lr=0.0001, max_lr=0.005, gamma=0.98, fused=False):
+        self.n_features = n_features
+        self.n_labels = n_labels
+        self.h_dim = h_dim
+        self.z_dim = z_dim
+        self.base_lr = base_lr
+        self.max_lr = max_lr
+        self.gamma = gamma
+        self.fused = fused
+
+        # -------------------------------------------------------------------------------------------------------------
+        # Create models
+        self.encoder = make_encoder_model_v1(n_features, h_dim, z_dim)
+        self.decoder = make_decoder_model_v1(z_dim + n_labels, n_features, h_dim)
+        self.discriminator = make_discriminator_model_v1(z_dim, h_dim)
+
+        # -------------------------------------------------------------------------------------------------------------
+        # Define loss functions
+        self.cross_entropy = tf.keras.losses.BinaryCrossentropy(from_logits=True)
+        self.mse = tf.keras.losses.MeanSquaredError()
+        self.accuracy = tf.keras.metrics.BinaryAccuracy()
+        # Accuracy of the current epoch only (self.accuracy accumulates over the whole training of a replica)
+        self.epoch_accuracy = tf.keras.metrics.BinaryAccuracy()
+
+        self.epoch_ae_loss_avg = tf.metrics.Mean()
+        self.epoch_dc_loss_avg = tf.metrics.Mean()
+        self.epoch_dc_acc_avg = tf.metrics.Mean()
+        self.epoch_gen_loss_avg = tf.metrics.Mean()
+
+        # -------------------------------------------------------------------------------------------------------------
+        # Define optimizers
+        # The three optimizers take one step per training step, so their iterations are all equal to the global step
+        self.lr_schedule = CyclicalLearningRate(base_lr, max_lr, step_size=1., gamma=gamma)
+
+        self.ae_optimizer = tf.keras.optimizers.Adam(learning_rate=self.lr_schedule)
+        self.dc_optimizer = tf.keras.optimizers.Adam(learning_rate=self.lr_schedule)
+        self.gen_optimizer = tf.keras.optimizers.Adam(learning_rate=self.lr_schedule)
+
+        # The state of the random ops of a traced function is not reset by tf.random.set_seed, so the samples of the
+        # prior distribution are drawn from a generator that is reseeded for each replica
+        self.generator = tf.random.experimental.Generator.from_seed(0)
+
+        # Number of epochs completed for the current replica
+        self.epoch = tf.Variable(0, dtype=tf.int64, trainable=False)
+
+        # State of the early stopping saved in the checkpoints when it is not used, so the checkpoints have the same
+        # structure with and without early stopping
+        self.idle_monitor = ConvergenceMonitor()
+
+        # Snapshot of the training state of a replica (the optimizers' iterations are the global step)
+        self.checkpoint = tf.train.Checkpoint(encoder=self.encoder,
+                                              decoder=self.decoder,
+                                              discriminator=self.discriminator,
+                                              ae_optimizer=self.ae_optimizer,
+                                              dc_optimizer=self.dc_optimizer,
+                                              gen_optimizer=self.gen_optimizer,
+                                              accuracy=self.accuracy,
+                                              generator=self.generator,
+                                              epoch=self.epoch,
+                                              monitor=self.idle_monitor)
+
+        # -------------------------------------------------------------------------------------------------------------
+        # Trace the training functions once, with a variable number of samples
+        self._step_fn = self._fused_train_step if fused else self._train_step
+
+        data_signature = [tf.TensorSpec([None, n_features], tf.float32),
+                          tf.TensorSpec([None, n_labels], tf.float32),
+                          tf.TensorSpec([None], tf.float32)]
+
+        # Single training step (traced on its first call)
+        self.train_step = tf.function(self._step_fn, input_signature=data_signature)
+
+        start = time.time()
+        self.train_epoch = tf.function(self._train_epoch,
+                                       input_signature=data_signature + [tf.TensorSpec([], tf.int32)])
+        self.train_epoch.get_concrete_function()
+        self.trace_time = time.time() - start
+
+        # Time of the first execution of the graph (with a single sample), which includes its optimisation
+        start = time.time()
+        self.train_epoch(tf.zeros([1, n_features]), tf.zeros([1, n_labels]), tf.ones([1]), tf.constant(1))
+        self.compile_time = time.time() - start
+
+    def discriminator_loss(self, real_output, fake_output, fake_weight):
+        loss_real = self.cross_entropy(tf.ones_like(real_output), real_output)
+        loss_fake = self.cross_entropy(tf.zeros_like(fake_output), fake_output, sample_weight=fake_weight)
+        return loss_fake + loss_real
+
+    def generator_loss(self, fake_output, fake_weight):
+        return self.cross_entropy(tf.ones_like(fake_output), fake_output, sample_weight=fake_weight)
+
+    def _train_step(self, batch_x, batch_y, batch_w):
+        encoder = self.encoder
+        decoder = self.decoder
+        discriminator = self.discriminator
+
+        # Normalize the sample weights so that the weighted losses are weighted means over the batch
+        batch_w = batch_w / tf.reduce_mean(batch_w)
+
+        # -------------------------------------------------------------------------------------------------------------
+        # Autoencoder
+        with tf.GradientTape() as ae_tape:
+            encoder_output = encoder(batch_x, training=True)
+            decoder_output = decoder(tf.concat([encoder_output, batch_y], axis=1), training=True)
+
+            # Autoencoder loss
+            ae_loss = self.mse(batch_x, decoder_output, sample_weight=batch_w)
+
+        ae_grads = ae_tape.gradient(ae_loss, encoder.trainable_variables + decoder.trainable_variables)
+        self.ae_optimizer.apply_gradients(zip(ae_grads, encoder.trainable_variables + decoder.trainable_variables))
+
+        # -------------------------------------------------------------------------------------------------------------
+        # Discriminator
+        with tf.GradientTape() as dc_tape:
+            real_distribution = self.generator.normal([tf.shape(batch_x)[0], self.z_dim], mean=0.0, stddev=1.0)
+            encoder_output = encoder(batch_x, training=True)
+
+            dc_real = discriminator(real_distribution, training=True)
+            dc_fake = discriminator(encoder_output, training=True)
+
+            # Discriminator Loss
+            dc_loss = self.discriminator_loss(dc_real, dc_fake, batch_w)
+
+            # Discriminator Acc
+            dc_labels = tf.concat([tf.ones_like(dc_real), tf.zeros_like(dc_fake)], axis=0)
+            dc_acc = self.accuracy(dc_labels, tf.concat([dc_real, dc_fake], axis=0))
+            self.epoch_accuracy.update_state(dc_labels, tf.concat([dc_real, dc_fake], axis=0))
+
+        dc_grads = dc_tape.gradient(dc_loss, discriminator.trainable_variables)
+        self.dc_optimizer.apply_gradients(zip(dc_grads, discriminator.trainable_variables))
+
+        # -------------------------------------------------------------------------------------------------------------
+        # Generator (Encoder)
+        with tf.GradientTape() as gen_tape:
+            encoder_output = encoder(batch_x, training=True)
+            dc_fake = discriminator(encoder_output, training=True)
+
+            # Generator loss
+            gen_loss = self.generator_loss(dc_fake, batch_w)
+
+        gen_grads = gen_tape.gradient(gen_loss, encoder.trainable_variables)
+        self.gen_optimizer.apply_gradients(zip(gen_grads, encoder.trainable_variables))
+
+        return ae_loss, dc_loss, dc_acc, gen_loss
+
+    def _fused_train_step(self, batch_x, batch_y, batch_w):
+        """Training step with the same updates as `_train_step` but fewer forward passes.
+
+        The encoder is not updated by the discriminator phase, so the discriminator and the generator phases share
+        the same encoder output (computed after the autoencoder update), and the discriminator is applied once to the
+        concatenation of the real and the fake codes. The generator phase still runs the discriminator on the fake
+        codes again, as it needs the discriminator updated in the discriminator phase.
+        """
+        encoder = self.encoder
+        decoder = self.decoder
+        discriminator = self.discriminator
+
+        # Normalize the sample weights so that the weighted losses are weighted means over the batch
+        batch_w = batch_w / tf.reduce_mean(batch_w)
+
+        # -------------------------------------------------------------------------------------------------------------
+        # Autoencoder
+        with tf.GradientTape() as ae_tape:
+            encoder_output = encoder(batch_x, training=True)
+            decoder_output = decoder(tf.concat([encoder_output, batch_y], axis=1), training=True)
+
+            # Autoencoder loss
+            ae_loss = self.mse(batch_x, decoder_output, sample_weight=batch_w)
+
+        ae_grads = ae_tape.gradient(ae_loss, encoder.trainable_variables + decoder.trainable_variables)
+        self.ae_optimizer.apply_gradients(zip(ae_grads, encoder.trainable_variables + decoder.trainable_variables))
+
+        with tf.GradientTape() as gen_tape:
+            encoder_output = encoder(batch_x, training=True)
+
+            # ---------------------------------------------------------------------------------------------------------
+            # Discriminator
+            with gen_tape.stop_recording():
+                batch_size = tf.shape(batch_x)[0]
+                with tf.GradientTape() as dc_tape:
+                    real_distribution = self.generator.normal([batch_size, self.z_dim], mean=0.0, stddev=1.0)
+
+                    dc_output = discriminator(tf.concat([real_distribution, encoder_output], axis=0), training=True)
+                    dc_real = dc_output[:batch_size]
+                    dc_fake = dc_output[batch_size:]
+
+                    # Discriminator Loss
+                    dc_loss = self.discriminator_loss(dc_real, dc_fake, batch_w)
+
+                    # Discriminator Acc
+                    dc_labels = tf.concat([tf.ones_like(dc_real), tf.zeros_like(dc_fake)], axis=0)
+                    dc_acc = self.accuracy(dc_labels, dc_output)
+                    self.epoch_accuracy.update_state(dc_labels, dc_output)
+
+                dc_grads = dc_tape.gradient(dc_loss, discriminator.trainable_variables)
+                self.dc_optimizer.apply_gradients(zip(dc_grads, discriminator.trainable_variables))
+
+            # ---------------------------------------------------------------------------------------------------------
+            # Generator (Encoder)
+            dc_fake = discriminator(encoder_output, training=True)
+
+            # Generator loss
+            gen_loss = self.generator_loss(dc_fake, batch_w)
+
+        gen_grads = gen_tape.gradient(gen_loss, encoder.trainable_variables)
+        self.gen_optimizer.apply_gradients(zip(gen_grads, encoder.trainable_variables))
+
+        return ae_loss, dc_loss, dc_acc, gen_loss
+
+    def _train_epoch(self, x, y, sample_weight, batch_size):
+        """Train the models for one epoch over the reshuffled data, updating the running means of the losses."""
+        n_rows = tf.shape(x)[0]
+        permutation = tf.argsort(self.generator.uniform([n_rows]))
+
+        for i_start in tf.range(0, n_rows, batch_size):
+            batch_indices = permutation[i_start:i_start + batch_size]
+
+            ae_loss, dc_loss, dc_acc, gen_loss = self._step_fn(tf.gather(x, batch_indices),
+                                                               tf.gather(y, batch_indices),
+                                                               tf.gather(sample_weight, batch_indices))
+
+            self.epoch_ae_loss_avg(ae_loss)
+            self.epoch_dc_loss_avg(dc_loss)
+            self.epoch_dc_acc_avg(dc_acc)
+            self.epoch_gen_loss_avg(gen_loss)
+
+    def reset(self, seed):
+        """Re-initialise the weights, the optimizers and the random number generator for a new replica.
+
+        The weights are drawn from the trainer's generator rather than from the global seed, as changing the global
+        seed makes TensorFlow instantiate again the graph of the training functions.
+        """
+        self.generator.reset_from_seed(seed)
+
+        # Same distributions as the default initializers of the Dense layers (Glorot uniform and zeros)
+        for model in [self.encoder, self.decoder, self.discriminator]:
+            for layer in model.layers:
+                if isinstance(layer, tf.keras.layers.Dense):
+                    fan_in, fan_out = layer.kernel.shape
+                    limit = np.sqrt(6. / (fan_in + fan_out))
+                    layer.kernel.assign(self.generator.uniform(layer.kernel.shape, minval=-limit, maxval=limit))
+                    layer.bias.assign(tf.zeros_like(layer.bias))
+
+        # Only the iterations and the moments are reset. The moments have the shapes of the weights, while the other
+        # variables of the optimizers are scalars (the iterations and, depending on the Keras version, the
+        # hyperparameters), so they are found the same way with the legacy and the new optimizers.
+        for optimizer in [self.ae_optimizer, self.dc_optimizer, self.gen_optimizer]:
+            optimizer.iterations.assign(0)
+            variables = optimizer.variables() if callable(optimizer.variables) else optimizer.variables
+            for variable in variables:
+                if variable.shape.rank > 0:
+                    variable.assign(tf.zeros_like(variable))
+
+        self.accuracy.reset_states()
+        self.epoch.assign(0)
+
+    def fit(self, x, y, sample_weight, batch_size, n_epochs, step_size, verbose=True,
+            checkpoint_dir=None, checkpoint_every=10, monitor=None):
+        """Train the models with the triangular cyclical learning rate with exponential decay.
+
+        Parameters
+        ----------
+        x: numpy.ndarray
+            Normalized brain regions.
+        y: numpy.ndarray
+            One-hot encoded demographic data.
+        sample_weight: numpy.ndarray
+            Weight of each sample in the losses.
+        batch_size: int
+            Number of rows in each batch.
+        n_epochs: int
+            Number of epochs.
+        step_size: float
+            Number of training steps in half a cycle of the learning rate.
+        verbose: bool
+            If True, print the mean losses of each epoch.
+        checkpoint_dir: PosixPath, optional
+            Directory of the checkpoints of the replica. If it contains a checkpoint, the training continues from it.
+        checkpoint_every: int
+            Number of epochs between checkpoints.
+        monitor: ConvergenceMonitor, optional
+            If given, the training stops before `n_epochs` once it converged. The number of epochs run is in `epoch`.
+
+        Returns
+        -------
+        The training time (in seconds).
+        """
+        self.lr_schedule.step_size.assign(step_size)
+
+        # Resumed trainings also restore the state of the monitor
+        tracked_monitor = monitor if monitor is not None else self.idle_monitor
+        tracked_monitor.reset()
+        self.checkpoint.monitor = tracked_monitor
+
+        x = tf.constant(x, dtype=tf.float32)
+        y = tf.constant(y, dtype=tf.float32)
+        sample_weight = tf.constant(sample_weight, dtype=tf.float32)
+        batch_size = tf.constant(batch_size, dtype=tf.int32)
+
+        checkpoint_manager = None
+        if checkpoint_dir is not None:
+            checkpoint_manager = tf.train.CheckpointManager(self.checkpoint, str(checkpoint_dir), max_to_keep=1)
+            if checkpoint_manager.latest_checkpoint:
+                self.checkpoint.restore(checkpoint_manager.latest_checkpoint).assert_existing_objects_matched()
+                if verbose:
+                    print('Restored {} (epoch {:d})'.format(checkpoint_manager.latest_checkpoint, int(self.epoch)))
+
+        training_time = 0
+        # A resumed training may have converged on the epoch of its checkpoint
+        converged = monitor is not None and bool(monitor.converged.numpy())
+        for epoch in range(int(self.epoch), n_epochs):
+            if converged:
+                break
+
+            start = time.time()
+
+            for metric in [self.epoch_ae_loss_avg, self.epoch_dc_loss_avg,
+                           self.epoch_dc_acc_avg, self.epoch_gen_loss_avg, self.epoch_accuracy]:
+                metric.reset_states()
+
+            self.train_epoch(x, y, sample_weight, batch_size)
+
+            epoch_time = time.time() - start
+            training_time = training_time + epoch_time
+
+            self.epoch.assign(epoch + 1)
+            if monitor is not None:
+                converged = monitor.update(epoch + 1,
+                                           self.epoch_ae_loss_avg.result().numpy(),
+                                           self.epoch_accuracy.result().numpy())
+
+            if checkpoint_manager is not None and (epoch + 1) % checkpoint_every == 0:
+                checkpoint_manager.save()
+
+            if verbose:
+                print('{:4d}: TIME: {:.2f} ETA: {:.2f} AE_LOSS: {:.4f} DC_LOSS: {:.4f} DC_ACC: {:.4f} GEN_LOSS: {:.4f}' \
+                      .format(epoch, epoch_time,
+                              epoch_time * (n_epochs - epoch),
+                              self.epoch_ae_loss_avg.result(),
+                              self.epoch_dc_loss_avg.result(),
+                              self.epoch_dc_acc_avg.result(),
+                              self.epoch_gen_loss_avg.result()))
+
+            if converged:
+                if verbose:
+                    print('Converged after {:d} epochs'.format(epoch + 1))
+                break
+
+        return training_time
+
+    def export_models(self):
+        """Creates copies of the trained models with the layer names of models built in a new session."""
+        tf.keras.backend.reset_uids()
+        encoder = make_encoder_model_v1(self.n_features, self.h_dim, self.z_dim)
+        decoder = make_decoder_model_v1(self.z_dim + self.n_labels, self.n_features, self.h_dim)
+        discriminator = make_discriminator_model_v1(self.z_dim, self.h_dim)
+
+        encoder.set_weights(self.encoder.get_weights())
+        decoder.set_weights(self.decoder.get_weights())
+        discriminator.set_weights(self.discriminator.get_weights())
+
+        return encoder, decoder, discriminator
@@ -5,9 +5,8 @@ from pathlib import Path
 
 import numpy as np
 import pandas as pd
-from scipy import stats
 
-from utils import COLUMNS_NAME, load_dataset, cliff_delta
+from utils import COLUMNS_NAME, load_dataset, rank_sum_test
 
 PROJECT_ROOT = Path.cwd()
 
@@ -36,17 +35,11 @@ def main(dataset_name, disease_label):
 
     clinical_df[COLUMNS_NAME] = (np.true_divide(x_dataset, tiv)).astype('float32')
 
-    results = pd.DataFrame()
+    _, pvalues, effect_sizes = rank_sum_test(clinical_df[clinical_df['Diagn']==hc_label][COLUMNS_NAME].values,
+                                             clinical_df[clinical_df['Diagn']==disease_label][COLUMNS_NAME].values)
 
-    for region in COLUMNS_NAME:
-
-        statistic, pvalue = stats.mannwhitneyu(clinical_df[clinical_df['Diagn']==hc_label][region],
-                                               clinical_df[clinical_df['Diagn']==disease_label][region])
-
-        effect_size = cliff_delta(clinical_df[clinical_df['Diagn']==hc_label][region].values,
-                                  clinical_df[clinical_df['Diagn']==disease_label][region].values)
-
-        results = results.append({'regions': region, 'effect size': effect_size, 'p-value': pvalue}, ignore_index=True)
+    results = pd.DataFrame({'effect size': effect_sizes, 'p-value': pvalues, 'regions': COLUMNS_NAME},
+                           columns=['effect size', 'p-value', 'regions'])
 
     results.to_csv(univariate_dir / '{}_{}_vs_{}.csv'.format(dataset_name, hc_label, disease_label), index=False)
 
@@ -8,19 +8,154 @@ import numpy as np
 PROJECT_ROOT = Path.cwd()
 
 
-def cliff_delta(X, Y):
-    """Calculate the effect size using the Cliff's delta."""
-    lx = len(X)
-    ly = len(Y)
-    mat = np.zeros((lx, ly))
-    for i in range(0, lx):
-        for j in range(0, ly):
-            if X[i] > Y[j]:
-                mat[i, j] = 1
-            elif Y[j] > X[i]:
-                mat[i, j] = -1
-
-    return (np.sum(mat)) / (lx * ly)
+def rank_data(a, axis=0, return_tie_term=False):
+    """Rank the values along `axis`, giving to the ties the average of their ranks (as scipy.stats.rankdata).
+
+    With `return_tie_term`, also return the sum of t^3 - t over the groups of t ties, used to correct the variance of
+    the rank sums.
+    """
+    a = np.moveaxis(np.asarray(a), axis, -1)
+    n = a.shape[-1]
+
+    order = np.argsort(a, axis=-1, kind='mergesort')
+    sorted_a = np.take_along_axis(a, order, axis=-1)
+
+    # First and last position of the group of ties of each sorted value
+    positions = np.arange(n)
+    new_group = np.ones(sorted_a.shape, dtype=bool)
+    new_group[..., 1:] = sorted_a[..., 1:] != sorted_a[..., :-1]
+    end_group = np.ones(sorted_a.shape, dtype=bool)
+    end_group[..., :-1] = new_group[..., 1:]
+
+    first = np.maximum.accumulate(np.where(new_group, positions, 0), axis=-1)
+    last = np.flip(np.minimum.accumulate(np.flip(np.where(end_group, positions, n - 1), axis=-1), axis=-1), axis=-1)
+
+    ranks = np.empty(sorted_a.shape)
+    np.put_along_axis(ranks, order, (first + last) / 2 + 1, axis=-1)
+    ranks = np.moveaxis(ranks, -1, axis)
+
+    if not return_tie_term:
+        return ranks
+
+    n_ties = (last - first + 1).astype('float64')
+    tie_term = np.sum(np.where(new_group, n_ties ** 3 - n_ties, 0), axis=-1)
+
+    return ranks, tie_term
+
+
+def rank_sum_test(X, Y, axis=0, use_continuity=True):
+    """Perform the Mann-Whitney U test and calculate the Cliff's delta from a single ranking of the pooled samples.
+
+    The samples are along `axis` and the other axes (e.g. the regions of [subject, region] arrays or the replicas and
+    the regions of [replica, subject, region] arrays) are computed at once. The p-values are two-sided and use the
+    normal approximation with tie correction (as scipy.stats.mannwhitneyu with method='asymptotic').
+
+    Returns
+    -------
+    The U statistics of X, the p-values and the Cliff's deltas.
+    """
+    # scipy.stats takes about a second to import, so it is only imported by the analyses using it
+    from scipy import stats
+
+    X = np.asarray(X)
+    Y = np.asarray(Y)
+    lx = X.shape[axis]
+    ly = Y.shape[axis]
+    n = lx + ly
+
+    ranks, tie_term = rank_data(np.concatenate((X, Y), axis=axis), axis=axis, return_tie_term=True)
+    u_statistic = np.sum(np.take(ranks, np.arange(lx), axis=axis), axis=axis) - lx * (lx + 1) / 2
+
+    # The number of pairs X > Y minus the number of pairs X < Y is 2U - lx * ly
+    effect_size = (2 * u_statistic - lx * ly) / (lx * ly)
+
+    mean_u = lx * ly / 2
+    std_u = np.sqrt(lx * ly / 12 * ((n + 1) - tie_term / (n * (n - 1))))
+
+    numerator = np.maximum(u_statistic, lx * ly - u_statistic) - mean_u
+    if use_continuity:
+        numerator = numerator - 0.5
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        pvalue = np.clip(2 * stats.norm.sf(numerator / std_u), 0, 1)
+
+    return u_statistic, pvalue, effect_size
+
+
+def cliff_delta(X, Y, axis=0):
+    """Calculate the effect size using the Cliff's delta.
+
+    The number of pairs X > Y minus the number of pairs X < Y is obtained from the sum of the ranks of X in the pooled
+    samples, with the ties counted exactly (see rank_sum_test).
+    """
+    return rank_sum_test(X, Y, axis=axis)[2]
+
+
+def roc_auc(negative_scores, positive_scores):
+    """Calculate the AUC-ROCs of the scores along the last axis, with the ties counted as half (see roc_curves)."""
+    negative_scores = np.asarray(negative_scores, dtype='float64')
+    positive_scores = np.asarray(positive_scores, dtype='float64')
+
+    u_statistic, _, _ = rank_sum_test(positive_scores, negative_scores, axis=-1)
+
+    return u_statistic / (positive_scores.shape[-1] * negative_scores.shape[-1])
+
+
+def roc_curves(negative_scores, positive_scores, n_points=101):
+    """Calculate the AUC-ROCs and the ROC curves interpolated on `n_points` false positive rates.
+
+    The scores are along the last axis and the leading axes (e.g. the bootstrap replicas of [replica, subject]
+    arrays) are computed at once. The AUCs are the Mann-Whitney U statistics of the positive scores divided by the
+    number of pairs, which is the area under the ROC curve with the ties counted as half. The true positive rates
+    are interpolated as np.interp on the curve of sklearn.metrics.roc_curve, starting at 0.
+
+    Returns
+    -------
+    The AUC-ROCs and the true positive rates, with shape [...] and [..., n_points].
+    """
+    negative_scores = np.asarray(negative_scores, dtype='float64')
+    positive_scores = np.asarray(positive_scores, dtype='float64')
+    n_negatives = negative_scores.shape[-1]
+    n_positives = positive_scores.shape[-1]
+
+    roc_aucs = roc_auc(negative_scores, positive_scores)
+
+    # Cumulative true and false positives with the scores sorted in descending order
+    scores = np.concatenate((negative_scores, positive_scores), axis=-1)
+    labels = np.concatenate((np.zeros(n_negatives), np.ones(n_positives)))
+
+    order = np.argsort(-scores, axis=-1, kind='mergesort')
+    sorted_scores = np.take_along_axis(scores, order, axis=-1)
+    true_positives = np.cumsum(labels[order], axis=-1)
+    false_positives = np.cumsum(1 - labels[order], axis=-1)
+
+    # Every score of a group of ties gets the point of the last score of the group (the threshold of the group)
+    n = scores.shape[-1]
+    end_group = np.ones(scores.shape, dtype=bool)
+    end_group[..., :-1] = sorted_scores[..., 1:] != sorted_scores[..., :-1]
+    last = np.flip(np.minimum.accumulate(np.flip(np.where(end_group, np.arange(n), n - 1), axis=-1), axis=-1), axis=-1)
+
+    zeros = np.zeros(scores.shape[:-1] + (1,))
+    fpr = np.concatenate((zeros, np.take_along_axis(false_positives, last, axis=-1) / n_negatives), axis=-1)
+    tpr = np.concatenate((zeros, np.take_along_axis(true_positives, last, axis=-1) / n_positives), axis=-1)
+
+    # Linear interpolation from the last point with a false positive rate lower or equal to each grid value
+    grid = np.linspace(0, 1, n_points)
+    i_point = np.sum(fpr[..., np.newaxis, :] <= grid[:, np.newaxis], axis=-1) - 1
+    i_next = np.minimum(i_point + 1, n)
+
+    fpr_start = np.take_along_axis(fpr, i_point, axis=-1)
+    fpr_end = np.take_along_axis(fpr, i_next, axis=-1)
+    tpr_start = np.take_along_axis(tpr, i_point, axis=-1)
+    tpr_end = np.take_along_axis(tpr, i_next, axis=-1)
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        slope = (tpr_end - tpr_start) / (fpr_end - fpr_start)
+        interpolated_tpr = np.where(fpr_end > fpr_start, slope * (grid - fpr_start) + tpr_start, tpr_start)
+
+    interpolated_tpr[..., 0] = 0.0
+
+    return roc_aucs, interpolated_tpr
 
 
 def load_dataset(demographic_path, ids_path, freesurfer_path):